@@ -0,0 +1,342 @@
+"""
+End-to-end load generator for the backend API
+Replays test_audio clips (plus synthetic variants of other lengths) against
+/process-audio and reports latency percentiles, throughput, error rate and
+server CPU/RSS over time
+
+Examples:
+    # Closed loop: 8 callers sending back to back for 60s against a running server
+    python loadtest.py --concurrency 8 --duration 60 --pid 12345
+
+    # Open loop: Poisson arrivals at 5 req/s, server spawned with ASR/LLM stand-ins
+    python loadtest.py --mode open --rate 5 --duration 60 --spawn --asr-standin --llm-standin
+"""
+import argparse
+import glob
+import io
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CLIPS = os.path.join(BACKEND_DIR, "test_audio", "*.wav")
+
+
+# ----------------------------------------
+# CLIPS
+# ----------------------------------------
+def load_clips(pattern: str) -> List[Tuple[str, bytes]]:
+    clips = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "rb") as f:
+            clips.append((os.path.basename(path), f.read()))
+    if not clips:
+        raise SystemExit(f"No audio clips match {pattern}")
+    return clips
+
+
+def synthesize_variant(clip: bytes, seconds: float) -> bytes:
+    """Loop or truncate a WAV clip's PCM to the requested length"""
+    with wave.open(io.BytesIO(clip), "rb") as src:
+        params = src.getparams()
+        frames = src.readframes(src.getnframes())
+    frame_size = params.sampwidth * params.nchannels
+    wanted = int(seconds * params.framerate) * frame_size
+    repeats = math.ceil(wanted / max(len(frames), 1))
+    pcm = (frames * repeats)[:wanted]
+
+    out = io.BytesIO()
+    with wave.open(out, "wb") as dst:
+        dst.setnchannels(params.nchannels)
+        dst.setsampwidth(params.sampwidth)
+        dst.setframerate(params.framerate)
+        dst.writeframes(pcm)
+    return out.getvalue()
+
+
+def build_workload(pattern: str, lengths: List[float]) -> List[Tuple[str, bytes]]:
+    clips = load_clips(pattern)
+    workload = list(clips)
+    for name, data in clips:
+        if not name.lower().endswith(".wav"):
+            continue
+        for seconds in lengths:
+            workload.append((f"{os.path.splitext(name)[0]}_{seconds:g}s.wav", synthesize_variant(data, seconds)))
+    return workload
+
+
+# ----------------------------------------
+# RESOURCE SAMPLING (Linux /proc)
+# ----------------------------------------
+class ResourceSampler(threading.Thread):
+    """Samples CPU% and RSS of a process at a fixed interval"""
+
+    def __init__(self, pid: int, interval: float = 1.0):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[Dict[str, float]] = []
+        self._stop_event = threading.Event()
+        self._ticks = os.sysconf("SC_CLK_TCK")
+
+    def _read(self) -> Optional[Tuple[float, float]]:
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu_seconds = (int(fields[11]) + int(fields[12])) / self._ticks
+            with open(f"/proc/{self.pid}/status") as f:
+                rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+            return cpu_seconds, rss_kb / 1024
+        except (OSError, StopIteration, IndexError, ValueError):
+            return None
+
+    def run(self):
+        started = time.monotonic()
+        previous = self._read()
+        previous_at = started
+        while not self._stop_event.wait(self.interval):
+            current = self._read()
+            now = time.monotonic()
+            if current is None or previous is None:
+                previous, previous_at = current, now
+                continue
+            self.samples.append({
+                "t": round(now - started, 2),
+                "cpu_percent": round(100 * (current[0] - previous[0]) / (now - previous_at), 1),
+                "rss_mb": round(current[1], 1),
+            })
+            previous, previous_at = current, now
+
+    def stop(self):
+        self._stop_event.set()
+
+
+# ----------------------------------------
+# LOAD GENERATION
+# ----------------------------------------
+class LoadTest:
+    def __init__(self, url: str, workload: List[Tuple[str, bytes]], timeout: float, priority: str = "interactive"):
+        self.url = url
+        self.workload = workload
+        self.timeout = timeout
+        self.priority = priority
+        self.results: List[Dict] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+            # Each generator thread is its own client for the server's per-client rate limits
+            self._local.session.headers.update({
+                "X-Priority": self.priority,
+                "X-Client-ID": f"loadtest-{threading.get_ident()}",
+            })
+        return self._local.session
+
+    def send(self, scheduled_at: Optional[float] = None):
+        """
+        Send one request
+
+        Open-loop requests are timed from their scheduled send time, so queueing
+        inside the generator is counted instead of hidden (coordinated omission).
+        """
+        name, data = random.choice(self.workload)
+        started = scheduled_at or time.monotonic()
+        status, error = None, None
+        try:
+            response = self._session().post(self.url, files={"file": (name, data, "audio/wav")}, timeout=self.timeout)
+            status = response.status_code
+            if status >= 400:
+                error = f"HTTP {status}"
+            else:
+                body = response.json()
+                if body.get("error"):
+                    error = body["error"]
+        except Exception as e:
+            error = f"{type(e).__name__}: {str(e)}"
+        finished = time.monotonic()
+        with self._lock:
+            self.results.append({
+                "clip": name,
+                "start": started,
+                "latency": finished - started,
+                "status": status,
+                "error": error,
+            })
+
+    def run_closed(self, concurrency: int, duration: float, total: Optional[int]):
+        """Closed loop: `concurrency` callers, each sending its next request when the last returns"""
+        deadline = time.monotonic() + duration
+        counter = iter(range(total)) if total else None
+
+        def caller():
+            while time.monotonic() < deadline:
+                if counter is not None and next(counter, None) is None:
+                    return
+                self.send()
+
+        threads = [threading.Thread(target=caller, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_open(self, rate: float, duration: float, total: Optional[int], max_in_flight: int):
+        """Open loop: Poisson arrivals at `rate` per second, independent of response times"""
+        deadline = time.monotonic() + duration
+        sent = 0
+        next_at = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+            while next_at < deadline and (not total or sent < total):
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.send, next_at)
+                sent += 1
+                next_at += random.expovariate(rate)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(results: List[Dict], wall_seconds: float, samples: List[Dict]) -> Dict:
+    latencies = sorted(r["latency"] for r in results)
+    errors = [r for r in results if r["error"]]
+    summary = {
+        "requests": len(results),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(results), 4) if results else 0.0,
+        "throughput_rps": round(len(results) / wall_seconds, 3) if wall_seconds else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 1),
+            "p95": round(percentile(latencies, 95) * 1000, 1),
+            "p99": round(percentile(latencies, 99) * 1000, 1),
+            "max": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        },
+        "error_samples": sorted({r["error"] for r in errors})[:5],
+    }
+    if samples:
+        summary["resources"] = {
+            "cpu_percent_mean": round(sum(s["cpu_percent"] for s in samples) / len(samples), 1),
+            "cpu_percent_max": max(s["cpu_percent"] for s in samples),
+            "rss_mb_max": max(s["rss_mb"] for s in samples),
+            "timeline": samples,
+        }
+    return summary
+
+
+def spawn_server(port: int, asr_standin: bool, llm_standin: bool) -> subprocess.Popen:
+    env = dict(os.environ)
+    if asr_standin:
+        env["ASR_STANDIN"] = "1"
+    if llm_standin:
+        env["LLM_STANDIN"] = "1"
+    # Measure the service, not the per-client rate limits (unless set explicitly)
+    for name in ("SCHEDULER_INTERACTIVE_RATE", "SCHEDULER_INTERACTIVE_BURST",
+                 "SCHEDULER_BATCH_RATE", "SCHEDULER_BATCH_BURST"):
+        env.setdefault(name, "1000000")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    for _ in range(600):
+        try:
+            requests.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return server
+        except requests.RequestException:
+            if server.poll() is not None:
+                raise SystemExit("Server exited during startup")
+            time.sleep(0.5)
+    server.terminate()
+    raise SystemExit("Server did not come up within 300s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the audio analysis API")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of a running server")
+    parser.add_argument("--endpoint", default="/process-audio", help="Upload endpoint to exercise")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed", help="Arrival model")
+    parser.add_argument("--concurrency", type=int, default=4, help="Callers in closed-loop mode")
+    parser.add_argument("--rate", type=float, default=2.0, help="Arrivals per second in open-loop mode")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Open-loop cap on outstanding requests")
+    parser.add_argument("--duration", type=float, default=30.0, help="Test length in seconds")
+    parser.add_argument("--requests", type=int, default=None, help="Stop after this many requests")
+    parser.add_argument("--clips", default=DEFAULT_CLIPS, help="Glob of audio clips to replay")
+    parser.add_argument("--synthetic-lengths", default="", help="Extra WAV variants, e.g. '5,30,120' seconds")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request timeout in seconds")
+    parser.add_argument("--pid", type=int, default=None, help="Server PID to sample CPU/RSS from")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="Resource sampling interval")
+    parser.add_argument("--spawn", action="store_true", help="Start a local server for the test")
+    parser.add_argument("--port", type=int, default=8765, help="Port for --spawn")
+    parser.add_argument("--asr-standin", action="store_true", help="With --spawn: skip Whisper (ASR_STANDIN=1)")
+    parser.add_argument("--llm-standin", action="store_true", help="With --spawn: skip Gemini (LLM_STANDIN=1)")
+    parser.add_argument("--priority", choices=["interactive", "batch"], default="interactive",
+                        help="Priority class sent as X-Priority")
+    parser.add_argument("--output", default=None, help="Write the full report as JSON here")
+    args = parser.parse_args()
+
+    lengths = [float(x) for x in args.synthetic_lengths.split(",") if x.strip()]
+    workload = build_workload(args.clips, lengths)
+
+    server = None
+    base_url, pid = args.url, args.pid
+    if args.spawn:
+        server = spawn_server(args.port, args.asr_standin, args.llm_standin)
+        base_url, pid = f"http://127.0.0.1:{args.port}", server.pid
+
+    sampler = ResourceSampler(pid, args.sample_interval) if pid else None
+    test = LoadTest(base_url.rstrip("/") + args.endpoint, workload, args.timeout, args.priority)
+    print(f"Running {args.mode}-loop test against {test.url} with {len(workload)} clips...")
+    try:
+        if sampler:
+            sampler.start()
+        started = time.monotonic()
+        if args.mode == "closed":
+            test.run_closed(args.concurrency, args.duration, args.requests)
+        else:
+            test.run_open(args.rate, args.duration, args.requests, args.max_in_flight)
+        wall_seconds = time.monotonic() - started
+    finally:
+        if sampler:
+            sampler.stop()
+        if server:
+            server.terminate()
+            server.wait(timeout=30)
+
+    summary = summarize(test.results, wall_seconds, sampler.samples if sampler else [])
+    summary["config"] = {
+        "mode": args.mode,
+        "concurrency": args.concurrency if args.mode == "closed" else None,
+        "rate": args.rate if args.mode == "open" else None,
+        "endpoint": args.endpoint,
+        "asr_standin": args.asr_standin,
+        "llm_standin": args.llm_standin,
+    }
+
+    printable = {k: v for k, v in summary.items() if k != "resources"}
+    if "resources" in summary:
+        printable["resources"] = {k: v for k, v in summary["resources"].items() if k != "timeline"}
+    print(json.dumps(printable, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Full report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,45 @@
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, UploadFile, Form, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
 from openai import OpenAI
 import uvicorn
 import tempfile
 import os
 import uuid
-from services.whisper_service import WhisperService
+import time
+from typing import Optional
+from services.whisper_service import create_whisper_service, load_native_pcm
+from services.job_queue import JobQueue, connect, JOB_MAX_BLOB_BYTES
+from services.session_store import SessionStore
+from services.scheduler import Scheduler, RateLimitExceeded
+from services.analytics import AnalyticsStore, ANALYTICS_ENABLED
+from services.profiling import install_profiling
+from services.upload_service import receive_upload, UploadLimitMiddleware
 import sys
 
 # Add mcp-order-status/server to path to import MCP server
 # mcp_server_path = os.path.join(os.path.dirname(__file__), '..', 'mcp-order-status', 'server')
 # sys.path.insert(0, mcp_server_path)
 ##from order_mcp_server import handle_mcp_request
-from services.gemini_server import extract_details, format_service_boy_response
+from services.gemini_server import extract_details, format_service_boy_response, extract_and_respond, extract_details_locally
 
 app = FastAPI()
 
+
+def record_rejected_upload(scope, status_code: int, detail: str, upload_bytes: int, started: float):
+    """Analytics record for uploads refused by UploadLimitMiddleware (they never reach the endpoint)"""
+    if analytics is None:
+        return
+    priority, client_id = request_class(Request(scope))
+    analytics.record({"priority": priority, "client_id": client_id, "error": f"HTTP {status_code}: {detail}",
+                      "upload_bytes": upload_bytes, "total_ms": elapsed_ms(started)})
+
+
+# Size limit and format sniff while the upload body is still being received
+# (added first so CORS headers still wrap its 413/415 responses)
+app.add_middleware(UploadLimitMiddleware, on_reject=record_rejected_upload)
+
 # CORS middleware to allow Angular frontend to connect
 app.add_middleware(
     CORSMiddleware,
@@ -24,10 +47,60 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Profile-Id", "X-Profile-Url", "X-Profile-Sections"],
 )
 
-# Initialize Whisper Service
-whisper_service = WhisperService(model_name="base")  # Using 'base' for faster startup
+# Opt-in request/process profiling (ENABLE_PROFILING=1); nothing is installed otherwise
+install_profiling(app)
+
+
+# One structured Gemini call for extraction + reply (set to 0 for the legacy two-call path)
+GEMINI_COMBINED_MODE = os.getenv("GEMINI_COMBINED_MODE", "1") == "1"
+
+# Early-exit transcription: stop decoding once these entities are heard
+# (send full_transcript=true to decode the whole recording, e.g. for audits)
+EARLY_EXIT_TRANSCRIPTION = os.getenv("EARLY_EXIT_TRANSCRIPTION", "1") == "1"
+EARLY_EXIT_ENTITIES = [e.strip() for e in os.getenv("EARLY_EXIT_ENTITIES", "order_id").split(",") if e.strip()]
+
+# Distributed mode: enqueue transcription/LLM jobs to a shared broker
+# (redis://... for real deployments, memory://local for an in-process stand-in)
+JOB_BROKER_URL = os.getenv("JOB_BROKER_URL")
+job_queue = JobQueue(connect(JOB_BROKER_URL)) if JOB_BROKER_URL else None
+
+# Initialize Whisper Service (API nodes behind a shared broker leave it to the workers)
+whisper_service = None
+if job_queue is None or JOB_BROKER_URL.startswith("memory://"):
+    whisper_service = create_whisper_service(model_name="base")  # Using 'base' for faster startup
+
+if job_queue is not None and whisper_service is not None:
+    from worker import start_worker_thread
+    start_worker_thread(job_queue, whisper_service)
+
+# Multi-turn call state, keyed by session_id (node-local; use sticky routing with several nodes)
+session_store = SessionStore()
+
+# Priority classes (X-Priority: interactive|batch), per-client rate limits and
+# fair queuing in front of the Whisper and Gemini stages
+scheduler = Scheduler()
+
+# Write-behind store of processed calls (ANALYTICS_ENABLED=0 to turn off)
+analytics = AnalyticsStore() if ANALYTICS_ENABLED else None
+
+
+@app.on_event("startup")
+async def start_analytics():
+    if analytics is not None:
+        analytics.start()
+
+
+@app.on_event("shutdown")
+async def stop_analytics():
+    if analytics is not None:
+        analytics.stop()
+
+
+def elapsed_ms(since: float) -> float:
+    return round((time.perf_counter() - since) * 1000, 1)
 
 # Initialize OpenAI client (set your API key as environment variable)
 #client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY"))
@@ -40,28 +113,87 @@ async def root():
     return {"message": "AI-Based Amazon Order Status Voice Assistant API"}
 
 
+def request_class(request: Optional[Request]):
+    """Priority class and client identity of a request (X-Priority / X-Client-ID headers)"""
+    if request is None:
+        return scheduler.normalize_priority(None), "anonymous"
+    client_id = request.headers.get("x-client-id") or (request.client.host if request.client else "anonymous")
+    return scheduler.normalize_priority(request.headers.get("x-priority")), client_id
+
+
 @app.post("/process-audio")
-async def process_audio(file: UploadFile = File(...)):
+async def process_audio(file: UploadFile = File(...), session_id: Optional[str] = Form(None),
+                        full_transcript: bool = Form(False), request: Request = None):
     """
     Main endpoint: Audio -> Whisper -> MCP Server -> Response
+
+    Pass the returned session_id with follow-up utterances of the same call;
+    entities and order lookups from earlier turns are reused, so each upload
+    only has to be transcribed and extracted on its own.
+
+    Transcription stops once the order entities still missing from the
+    session have been heard; set full_transcript to decode everything.
+
+    Live calls are the default; bulk reprocessing should send
+    `X-Priority: batch` so it only uses capacity live calls leave free.
     """
-    temp_path = None
+    upload = None
     audio_filename = None
     
+    priority, client_id = request_class(request)
+    started = time.perf_counter()
+    timings = {}
+    call = {"priority": priority, "client_id": client_id, "session_id": session_id}
+
     try:
-        # Step 1: Save uploaded file
-        file_extension = os.path.splitext(file.filename)[1] or ".wav"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp:
-            content = await file.read()
-            temp.write(content)
-            temp_path = temp.name
+        try:
+            scheduler.admit(priority, client_id)
+        except RateLimitExceeded as e:
+            raise HTTPException(status_code=429, detail=str(e))
+
+        # Step 1: Validate the upload (the middleware already refused oversized or non-audio bodies)
+        upload = await receive_upload(file)
+        timings["upload_ms"] = elapsed_ms(started)
+        call.update(upload_bytes=upload.size, audio_seconds=upload.duration)
+        session = session_store.get_or_create(session_id)
+        call["session_id"] = session.session_id
+        known = dict(session.entities)
 
         # Step 2: Transcription using Whisper Service
-        print(f"Transcribing audio/video file: {temp_path}")
-        result = whisper_service.transcribe_file(temp_path)
+        required = []
+        if EARLY_EXIT_TRANSCRIPTION and not full_transcript:
+            required = [name for name in EARLY_EXIT_ENTITIES if not known.get(name)]
+        extractor = extract_details_locally if required else None
+        stage_started = time.perf_counter()
+
+        if job_queue is not None:
+            if upload.size > JOB_MAX_BLOB_BYTES:
+                raise HTTPException(status_code=413, detail=f"Upload exceeds {JOB_MAX_BLOB_BYTES} bytes")
+            print(f"Enqueueing {upload.format} transcription job")
+            # Hashing and pushing the upload blocks, so it runs off the event loop
+            key = await run_in_threadpool(job_queue.submit, "transcribe", {"suffix": upload.suffix, "required": required},
+                                          blob_chunks=upload.iter_chunks, priority=priority)
+            result = await job_queue.wait_result(key)
+        else:
+            # 16 kHz mono PCM (what the frontend sends) is decoded in-process, no ffmpeg
+            audio = None
+            if upload.format == "wav":
+                with upload.open() as stream:
+                    audio = load_native_pcm(stream)
+            if audio is not None:
+                result = await scheduler.run("asr", priority, client_id, whisper_service.transcribe_audio,
+                                             audio, extractor, required, timings=timings)
+            else:
+                temp_path = upload.path()
+                print(f"Transcribing {upload.format} file: {temp_path}")
+                result = await scheduler.run("asr", priority, client_id, whisper_service.transcribe_file,
+                                             temp_path, extractor, required, timings=timings)
         transcription = result.get("text", "")
+        timings["asr_ms"] = round(elapsed_ms(stage_started) - timings.get("asr_queue_ms", 0), 1)
+        call.update(transcript=transcription, transcript_complete=not result.get("early_exit", False))
         
         if not transcription.strip():
+            call["error"] = "No speech detected"
             return {
                 "error": "No speech detected in the audio file",
                 "transcript": ""
@@ -71,14 +203,37 @@ async def process_audio(file: UploadFile = File(...)):
         print("Processing through Gemini Server...")
         # Commented out MCP server code
         # mcp_result = process_text(transcription)
+        stage_started = time.perf_counter()
         
-        # Call Gemini server's extract_details method
-        extracted_data = extract_details(transcription)
-        human_readable_text = format_service_boy_response(extracted_data, transcription)
+        if job_queue is not None:
+            key = await run_in_threadpool(
+                job_queue.submit, "llm", {"transcript": transcription, "combined": GEMINI_COMBINED_MODE, "known": known},
+                priority=priority,
+            )
+            llm_result = await job_queue.wait_result(key)
+            extracted_data, human_readable_text = llm_result["data"], llm_result["response_text"]
+        elif GEMINI_COMBINED_MODE:
+            extracted_data, human_readable_text = await scheduler.run(
+                "llm", priority, client_id, extract_and_respond, transcription, known, session.lookups, timings=timings
+            )
+        else:
+            # Call Gemini server's extract_details method
+            extracted_data = await scheduler.run(
+                "llm", priority, client_id, extract_details, transcription, known, session.lookups, timings=timings
+            )
+            human_readable_text = await scheduler.run(
+                "llm", priority, client_id, format_service_boy_response, extracted_data, transcription, timings=timings
+            )
         
+        timings["llm_ms"] = round(elapsed_ms(stage_started) - timings.get("llm_queue_ms", 0), 1)
+        
+        session.add_turn(transcription, extracted_data)
+
         # Create result structure similar to MCP server response
         mcp_result = {
+            "session_id": session.session_id,
             "transcript": transcription,
+            "transcript_complete": not result.get("early_exit", False),
             "mobile_number": extracted_data.get("mobile_number"),
             "order_id": extracted_data.get("order_id"),
             "customer_name": extracted_data.get("name"),
@@ -93,10 +248,20 @@ async def process_audio(file: UploadFile = File(...)):
             "response_text": human_readable_text,
             "response_voice_text": human_readable_text
         }
+        call.update(
+            mobile_number=mcp_result["mobile_number"], order_id=mcp_result["order_id"],
+            customer_name=mcp_result["customer_name"], status_found=bool(mcp_result["status_found"]),
+            order_status=mcp_result["order_status"]["status"],
+            entities={k: v for k, v in extracted_data.items() if isinstance(v, (str, int, float, bool, type(None)))},
+        )
         
         return mcp_result
 
+    except HTTPException as e:
+        call["error"] = f"HTTP {e.status_code}: {e.detail}"
+        raise
     except Exception as e:
+        call["error"] = str(e)
         print(f"Error processing audio: {str(e)}")
         import traceback
         traceback.print_exc()
@@ -120,19 +285,20 @@ async def process_audio(file: UploadFile = File(...)):
         }
     
     finally:
-        # Clean up temporary files
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.unlink(temp_path)
-            except Exception as e:
-                print(f"Error deleting temp file: {str(e)}")
+        # Clean up spooled upload
+        if upload is not None:
+            upload.close()
+        if analytics is not None:
+            timings["total_ms"] = elapsed_ms(started)
+            analytics.record({**call, **timings})
 
 
 # Keep /analyze endpoint for backward compatibility
 @app.post("/analyze")
-async def analyze(file: UploadFile = File(...)):
+async def analyze(file: UploadFile = File(...), session_id: Optional[str] = Form(None),
+                  full_transcript: bool = Form(False), request: Request = None):
     """Legacy endpoint - redirects to /process-audio"""
-    return await process_audio(file)
+    return await process_audio(file, session_id, full_transcript, request)
 
 
 @app.get("/audio/{filename}")
@@ -148,9 +314,32 @@ async def get_audio(filename: str):
 
 # Keep old endpoint for backward compatibility
 @app.post("/analyze-audio")
-async def analyze_audio(file: UploadFile = File(...)):
+async def analyze_audio(file: UploadFile = File(...), session_id: Optional[str] = Form(None),
+                        full_transcript: bool = Form(False), request: Request = None):
     """Legacy endpoint - redirects to /analyze"""
-    return await analyze(file)
+    return await analyze(file, session_id, full_transcript, request)
+
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    """Queue depth, queue-wait times and preemptions per stage and priority class"""
+    return scheduler.stats()
+
+
+@app.get("/analytics/daily")
+async def analytics_daily(days: int = 7):
+    """Calls per day over the last `days` days"""
+    if analytics is None:
+        raise HTTPException(status_code=404, detail="Analytics disabled")
+    return await run_in_threadpool(analytics.daily_volumes, days)
+
+
+@app.get("/analytics/latency")
+async def analytics_latency(days: int = 7):
+    """Per-stage latency (mean/p50/p95/max ms) per day over the last `days` days"""
+    if analytics is None:
+        raise HTTPException(status_code=404, detail="Analytics disabled")
+    return await run_in_threadpool(analytics.latency_breakdown, days)
 
 
 if __name__ == "__main__":
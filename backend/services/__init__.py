@@ -3,7 +3,7 @@ Services module for backend
 Contains WhisperService
 MCP Server is now in mcp-order-status/server/
 """
-from .whisper_service import WhisperService
+from .whisper_service import WhisperService, StandinWhisperService, create_whisper_service
 
-__all__ = ['WhisperService']
+__all__ = ['WhisperService', 'StandinWhisperService', 'create_whisper_service']
 
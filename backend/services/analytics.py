@@ -0,0 +1,254 @@
+"""
+Call Analytics Store
+Write-behind sink for processed calls: the request path appends a record to
+an in-memory buffer and a background thread flushes batches into SQLite
+files, rotated by size and age
+
+At most one flush interval (or one batch) of records is lost on a crash; the
+buffer is bounded, and when the disk cannot keep up the oldest records are
+dropped and counted instead of blocking requests.
+"""
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional
+
+ANALYTICS_ENABLED = os.getenv("ANALYTICS_ENABLED", "1") == "1"
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", os.path.join(os.path.dirname(__file__), "..", "analytics"))
+ANALYTICS_FLUSH_SECONDS = float(os.getenv("ANALYTICS_FLUSH_SECONDS", "2"))
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", "200"))
+ANALYTICS_MAX_BUFFER = int(os.getenv("ANALYTICS_MAX_BUFFER", "10000"))
+ANALYTICS_ROTATE_BYTES = int(os.getenv("ANALYTICS_ROTATE_BYTES", str(64 * 1024 * 1024)))
+ANALYTICS_ROTATE_SECONDS = float(os.getenv("ANALYTICS_ROTATE_SECONDS", str(24 * 3600)))
+
+# Per-stage timings in milliseconds, one column each
+TIMING_COLUMNS = ("total_ms", "upload_ms", "asr_queue_ms", "asr_ms", "llm_queue_ms", "llm_ms")
+
+COLUMNS = (
+    "ts", "day", "session_id", "priority", "client_id", "transcript", "transcript_complete",
+    "mobile_number", "order_id", "customer_name", "status_found", "order_status", "entities",
+    "error", "upload_bytes", "audio_seconds",
+) + TIMING_COLUMNS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    ts REAL NOT NULL,
+    day TEXT NOT NULL,
+    session_id TEXT,
+    priority TEXT,
+    client_id TEXT,
+    transcript TEXT,
+    transcript_complete INTEGER,
+    mobile_number TEXT,
+    order_id TEXT,
+    customer_name TEXT,
+    status_found INTEGER,
+    order_status TEXT,
+    entities TEXT,
+    error TEXT,
+    upload_bytes INTEGER,
+    audio_seconds REAL,
+    total_ms REAL,
+    upload_ms REAL,
+    asr_queue_ms REAL,
+    asr_ms REAL,
+    llm_queue_ms REAL,
+    llm_ms REAL
+);
+CREATE INDEX IF NOT EXISTS calls_day ON calls (day);
+"""
+
+
+class AnalyticsStore:
+    """Buffered, append-only store of processed calls"""
+
+    def __init__(self, directory: str = ANALYTICS_DIR, flush_seconds: float = ANALYTICS_FLUSH_SECONDS,
+                 batch_size: int = ANALYTICS_BATCH_SIZE, max_buffer: int = ANALYTICS_MAX_BUFFER,
+                 rotate_bytes: int = ANALYTICS_ROTATE_BYTES, rotate_seconds: float = ANALYTICS_ROTATE_SECONDS):
+        self.directory = os.path.abspath(directory)
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.dropped = 0
+        self.written = 0
+        self._buffer: Deque[tuple] = deque()
+        self._max_buffer = max_buffer
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Only touched by the flushing thread (or by flush() after stop)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._path: Optional[str] = None
+        self._opened_at = 0.0
+
+    # ----------------------------------------
+    # REQUEST PATH
+    # ----------------------------------------
+    def record(self, call: Dict[str, Any]):
+        """Queue one call record; never blocks on disk"""
+        ts = call.get("ts") or time.time()
+        row = dict(call, ts=ts, day=datetime.fromtimestamp(ts).strftime("%Y-%m-%d"))
+        if isinstance(row.get("entities"), dict):
+            row["entities"] = json.dumps(row["entities"])
+        values = tuple(row.get(column) for column in COLUMNS)
+        with self._lock:
+            if len(self._buffer) >= self._max_buffer:
+                self._buffer.popleft()
+                self.dropped += 1
+            self._buffer.append(values)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    # ----------------------------------------
+    # BACKGROUND FLUSHING
+    # ----------------------------------------
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="analytics-writer", daemon=True)
+        self._thread.start()
+        print(f"[INFO] Call analytics written to {self.directory}")
+
+    def stop(self):
+        """Flush what is buffered and stop the writer"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[WARNING] Analytics flush failed: {str(e)}")
+
+    def flush(self) -> int:
+        """Write all buffered records in batches; returns the number written"""
+        count = 0
+        while True:
+            with self._lock:
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            if not batch:
+                return count
+            conn = self._connection()
+            try:
+                with conn:
+                    conn.executemany(
+                        f"INSERT INTO calls ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", batch
+                    )
+            except sqlite3.Error:
+                # Put the batch back so a transient error does not lose it
+                with self._lock:
+                    self._buffer.extendleft(reversed(batch))
+                raise
+            count += len(batch)
+            self.written += len(batch)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is not None and self._should_rotate():
+            self._conn.close()
+            self._conn = None
+        if self._conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._path = os.path.join(self.directory, f"calls-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.sqlite")
+            self._conn = sqlite3.connect(self._path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+            self._opened_at = time.monotonic()
+        return self._conn
+
+    def _should_rotate(self) -> bool:
+        if time.monotonic() - self._opened_at > self.rotate_seconds:
+            return True
+        try:
+            return os.path.getsize(self._path) > self.rotate_bytes
+        except OSError:
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            buffered = len(self._buffer)
+        return {"buffered": buffered, "written": self.written, "dropped": self.dropped,
+                "current_file": os.path.basename(self._path) if self._path else None}
+
+    # ----------------------------------------
+    # QUERIES
+    # ----------------------------------------
+    def _files(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, "calls-*.sqlite")))
+
+    def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        rows = []
+        for path in self._files():
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                rows.extend(conn.execute(sql, params).fetchall())
+            except sqlite3.Error as e:
+                print(f"[WARNING] Skipping analytics file {os.path.basename(path)}: {str(e)}")
+            finally:
+                conn.close()
+        return rows
+
+    def daily_volumes(self, days: int = 7) -> List[Dict[str, Any]]:
+        """Calls per day: total, order found, errors and early-exit transcripts"""
+        since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        totals: Dict[str, Dict[str, Any]] = {}
+        for day, calls, found, errors, partial in self._query(
+            "SELECT day, COUNT(*), SUM(status_found), SUM(error IS NOT NULL), SUM(transcript_complete = 0) "
+            "FROM calls WHERE day >= ? GROUP BY day",
+            (since,),
+        ):
+            entry = totals.setdefault(day, {"day": day, "calls": 0, "status_found": 0, "errors": 0, "early_exit": 0})
+            entry["calls"] += calls
+            entry["status_found"] += found or 0
+            entry["errors"] += errors or 0
+            entry["early_exit"] += partial or 0
+        return [totals[day] for day in sorted(totals)]
+
+    def latency_breakdown(self, days: int = 7) -> List[Dict[str, Any]]:
+        """Per day and stage: mean, p50, p95 and max of each timing column (ms)"""
+        since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        values: Dict[str, Dict[str, List[float]]] = {}
+        for row in self._query(
+            f"SELECT day, {', '.join(TIMING_COLUMNS)} FROM calls WHERE day >= ? AND error IS NULL", (since,)
+        ):
+            stages = values.setdefault(row[0], {column: [] for column in TIMING_COLUMNS})
+            for column, value in zip(TIMING_COLUMNS, row[1:]):
+                if value is not None:
+                    stages[column].append(value)
+
+        breakdown = []
+        for day in sorted(values):
+            entry = {"day": day}
+            for column, samples in values[day].items():
+                if not samples:
+                    continue
+                samples.sort()
+                entry[column] = {
+                    "mean": round(sum(samples) / len(samples), 1),
+                    "p50": round(samples[len(samples) // 2], 1),
+                    "p95": round(samples[max(int(len(samples) * 0.95) - 1, 0)], 1),
+                    "max": round(samples[-1], 1),
+                }
+            breakdown.append(entry)
+        return breakdown
@@ -0,0 +1,408 @@
+"""
+Distributed Job Queue
+Redis-protocol job queue and shared result cache for transcription/LLM jobs,
+with an in-process stand-in (memory://) for local runs
+"""
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+try:
+    import redis
+except ImportError:  # Only needed for redis:// brokers
+    redis = None
+
+from services.scheduler import INTERACTIVE, BATCH, PRIORITY_CLASSES
+
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+# LLM results embed the order status from the CSV, so they are only reused briefly
+JOB_LLM_RESULT_TTL_SECONDS = int(os.getenv("JOB_LLM_RESULT_TTL_SECONDS", "60"))
+# Errors and uncacheable results only live long enough for the waiting request to read them
+JOB_ERROR_TTL_SECONDS = int(os.getenv("JOB_ERROR_TTL_SECONDS", "30"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Largest upload sent through the broker
+JOB_MAX_BLOB_BYTES = int(os.getenv("JOB_MAX_BLOB_BYTES", str(25 * 1024 * 1024)))
+# Blob chunks pushed/read per broker round trip
+BLOB_CHUNKS_PER_CALL = 16
+
+
+class FakeRedis:
+    """
+    In-process stand-in for the subset of the Redis API the queue uses
+
+    Thread-safe; values are stored as bytes like redis-py returns them.
+    """
+
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._expiry: Dict[str, float] = {}
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def _bytes(value) -> bytes:
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def _alive(self, name: str) -> bool:
+        expires = self._expiry.get(name)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(name, None)
+            self._expiry.pop(name, None)
+        return name in self._data
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self._cond:
+            return self._data[name] if self._alive(name) else None
+
+    def set(self, name: str, value, ex: Optional[int] = None, nx: bool = False) -> Optional[bool]:
+        with self._cond:
+            if nx and self._alive(name):
+                return None
+            self._data[name] = self._bytes(value)
+            self._expiry.pop(name, None)
+            if ex:
+                self._expiry[name] = time.monotonic() + ex
+            return True
+
+    def exists(self, *names: str) -> int:
+        with self._cond:
+            return sum(1 for name in names if self._alive(name))
+
+    def delete(self, *names: str) -> int:
+        with self._cond:
+            removed = 0
+            for name in names:
+                if self._alive(name):
+                    del self._data[name]
+                    self._expiry.pop(name, None)
+                    removed += 1
+            return removed
+
+    def lpush(self, name: str, *values) -> int:
+        with self._cond:
+            items = self._data.setdefault(name, [])
+            for value in values:
+                items.insert(0, self._bytes(value))
+            self._cond.notify_all()
+            return len(items)
+
+    def rpush(self, name: str, *values) -> int:
+        with self._cond:
+            items = self._data.setdefault(name, [])
+            items.extend(self._bytes(value) for value in values)
+            return len(items)
+
+    def expire(self, name: str, seconds: int) -> bool:
+        with self._cond:
+            if not self._alive(name):
+                return False
+            self._expiry[name] = time.monotonic() + seconds
+            return True
+
+    def lrange(self, name: str, start: int, end: int):
+        with self._cond:
+            items = self._data.get(name, [])
+            return list(items[start:] if end == -1 else items[start:end + 1])
+
+    def lrem(self, name: str, count: int, value) -> int:
+        with self._cond:
+            items = self._data.get(name, [])
+            value = self._bytes(value)
+            removed = 0
+            while value in items and (count == 0 or removed < count):
+                items.remove(value)
+                removed += 1
+            return removed
+
+    def rpoplpush(self, src: str, dst: str) -> Optional[bytes]:
+        with self._cond:
+            if not self._data.get(src):
+                return None
+            value = self._data[src].pop()
+            self._data.setdefault(dst, []).insert(0, value)
+            return value
+
+    def brpoplpush(self, src: str, dst: str, timeout: int = 0) -> Optional[bytes]:
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._cond:
+            while not self._data.get(src):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            value = self._data[src].pop()
+            self._data.setdefault(dst, []).insert(0, value)
+            return value
+
+
+_memory_brokers: Dict[str, FakeRedis] = {}
+
+
+def connect(url: str):
+    """
+    Open a broker connection
+
+    Args:
+        url: redis://host:port/db for a real broker, memory://name for the
+            in-process stand-in (shared by everything in this process)
+    """
+    if url.startswith("memory://"):
+        return _memory_brokers.setdefault(url, FakeRedis())
+    if redis is None:
+        raise RuntimeError("The 'redis' package is required for JOB_BROKER_URL=" + url)
+    return redis.Redis.from_url(url)
+
+
+def job_key(kind: str, payload: Dict[str, Any], blob_chunks: Optional[Iterable[bytes]] = None) -> str:
+    """Idempotent job key: identical work always maps to the same key"""
+    digest = hashlib.sha256(kind.encode())
+    digest.update(json.dumps(payload, sort_keys=True).encode())
+    for chunk in blob_chunks or ():
+        digest.update(chunk)
+    return f"{kind}:{digest.hexdigest()}"
+
+
+def _cacheable(result: Dict[str, Any]) -> bool:
+    return "error" not in result and result.get("cacheable", True)
+
+
+class JobQueue:
+    """
+    At-least-once job queue over a Redis-protocol broker
+
+    Keys (under `namespace`):
+        queue:<priority>     - pending job keys per class (interactive, batch);
+                               workers only take batch jobs when no live call waits
+        processing           - jobs claimed by a worker
+        job:<key>            - job record, SET NX so duplicates are not re-enqueued
+        blob:<key>           - binary payload (audio) for the job, as a list of chunks
+        lease:<key>          - held (and renewed) by the worker running the job;
+                               jobs whose lease is gone are put back on the queue
+        result:<key>         - result JSON, doubles as the shared cache
+
+    Errors and results a handler marks `"cacheable": False` are kept for
+    `error_ttl` only and are never reused by a later submit.
+    """
+
+    def __init__(self, client, namespace: str = "avq", lease_seconds: int = JOB_LEASE_SECONDS,
+                 result_ttl: int = JOB_RESULT_TTL_SECONDS, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 result_ttls: Optional[Dict[str, int]] = None, error_ttl: int = JOB_ERROR_TTL_SECONDS):
+        self.client = client
+        self.namespace = namespace
+        self.lease_seconds = lease_seconds
+        self.result_ttl = result_ttl
+        self.result_ttls = {"llm": JOB_LLM_RESULT_TTL_SECONDS} if result_ttls is None else result_ttls
+        self.error_ttl = error_ttl
+        self.max_attempts = max_attempts
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._suspects = set()
+
+    def _k(self, *parts: str) -> str:
+        return ":".join((self.namespace,) + parts)
+
+    def _queue(self, priority: Optional[str]) -> str:
+        return self._k("queue", priority if priority in PRIORITY_CLASSES else INTERACTIVE)
+
+    # ----------------------------------------
+    # PRODUCER SIDE (API nodes)
+    # ----------------------------------------
+    def submit(self, kind: str, payload: Dict[str, Any],
+               blob_chunks: Optional[Callable[[], Iterable[bytes]]] = None, priority: str = INTERACTIVE) -> str:
+        """
+        Enqueue a job unless its result is cached or it is already queued
+
+        Args:
+            kind: Handler name
+            payload: JSON-serialisable job arguments
+            blob_chunks: Returns a fresh iterator over the binary payload; it is
+                read twice (hash, then upload) so the blob is never held whole
+            priority: Scheduler class; not part of the job key, so live and
+                batch requests for the same input share one job
+
+        Returns:
+            Job key to wait on
+        """
+        key = job_key(kind, payload, blob_chunks() if blob_chunks else None)
+        cached = self.result(key)
+        if cached is not None:
+            if _cacheable(cached):
+                return key
+            # A failed or degraded run is not reused: run the job again
+            self.client.delete(self._k("result", key))
+
+        record = json.dumps({"kind": kind, "payload": payload, "attempts": 0, "has_blob": blob_chunks is not None,
+                             "priority": priority})
+        if self.client.set(self._k("job", key), record, nx=True, ex=self.result_ttl):
+            if blob_chunks is not None:
+                self._upload_blob(key, blob_chunks())
+            self.client.lpush(self._queue(priority), key)
+        elif priority == INTERACTIVE and self.client.lrem(self._queue(BATCH), 1, key):
+            # A live call now waits on a queued batch job: move it to the live queue
+            self.client.lpush(self._queue(INTERACTIVE), key)
+        return key
+
+    def _upload_blob(self, key: str, chunks: Iterable[bytes]):
+        name = self._k("blob", key)
+        self.client.delete(name)
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) == BLOB_CHUNKS_PER_CALL:
+                self.client.rpush(name, *batch)
+                batch = []
+        if batch:
+            self.client.rpush(name, *batch)
+        self.client.expire(name, self.result_ttl)
+
+    def _blob_chunks(self, key: str) -> Iterator[bytes]:
+        name = self._k("blob", key)
+        start = 0
+        while True:
+            chunks = self.client.lrange(name, start, start + BLOB_CHUNKS_PER_CALL - 1)
+            if not chunks:
+                return
+            yield from chunks
+            start += len(chunks)
+
+    def result(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = self.client.get(self._k("result", key))
+        return json.loads(raw) if raw else None
+
+    async def wait_result(self, key: str, timeout: float = 300, poll_interval: float = 0.05) -> Dict[str, Any]:
+        """Poll for a job result without blocking the event loop (each GET runs on the loop's executor)"""
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        while True:
+            result = await loop.run_in_executor(None, self.result, key)
+            if result is not None:
+                if "error" in result:
+                    raise RuntimeError(result["error"])
+                return result
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Job {key} did not finish within {timeout}s")
+            await asyncio.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, 0.5)
+
+    # ----------------------------------------
+    # CONSUMER SIDE (workers)
+    # ----------------------------------------
+    def work_once(self, handlers: Dict[str, Callable[[Dict[str, Any], Optional[Iterator[bytes]]], Dict[str, Any]]],
+                  block_seconds: int = 1) -> bool:
+        """
+        Claim and run one job
+
+        Handlers get the payload and an iterator over the blob chunks (None
+        for jobs without a blob). Interactive jobs are always claimed before
+        batch jobs.
+
+        Returns:
+            True if a job was claimed, False if the queue stayed empty
+        """
+        raw_key = self._claim(block_seconds)
+        if raw_key is None:
+            return False
+        key = raw_key.decode() if isinstance(raw_key, bytes) else raw_key
+        self.client.set(self._k("lease", key), self.worker_id, ex=self.lease_seconds)
+        # Keep the lease alive while the handler runs, however long the job takes
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._renew_lease, args=(key, done), name="job-lease", daemon=True)
+        heartbeat.start()
+
+        try:
+            raw_record = self.client.get(self._k("job", key))
+            # Duplicate delivery of a finished job, or a record that expired
+            if self.client.exists(self._k("result", key)) or raw_record is None:
+                return True
+
+            record = json.loads(raw_record)
+            handler = handlers.get(record["kind"])
+            if handler is None:
+                self._store_result(key, {"error": f"No handler for job kind '{record['kind']}'"}, record["kind"])
+                return True
+
+            try:
+                blob = self._blob_chunks(key) if record.get("has_blob") else None
+                result = handler(record["payload"], blob)
+                self._store_result(key, result, record["kind"])
+            except Exception as e:
+                record["attempts"] += 1
+                print(f"[ERROR] Job {key} failed (attempt {record['attempts']}): {str(e)}")
+                if record["attempts"] >= self.max_attempts:
+                    self._store_result(key, {"error": f"{type(e).__name__}: {str(e)}"}, record["kind"])
+                else:
+                    self.client.set(self._k("job", key), json.dumps(record), ex=self.result_ttl)
+                    self.client.lpush(self._queue(record.get("priority")), key)
+            return True
+        finally:
+            done.set()
+            heartbeat.join()
+            self.client.lrem(self._k("processing"), 1, key)
+            self.client.delete(self._k("lease", key))
+
+    def _renew_lease(self, key: str, done: threading.Event):
+        """Refresh the job's lease every third of its lifetime until `done` is set"""
+        while not done.wait(max(self.lease_seconds / 3, 1)):
+            try:
+                self.client.set(self._k("lease", key), self.worker_id, ex=self.lease_seconds)
+            except Exception as e:
+                print(f"[WARNING] Could not renew lease for job {key}: {str(e)}")
+
+    def _claim(self, block_seconds: int) -> Optional[bytes]:
+        """Move the next job key to `processing`, draining the interactive queue first"""
+        for priority in PRIORITY_CLASSES:
+            raw_key = self.client.rpoplpush(self._queue(priority), self._k("processing"))
+            if raw_key is not None:
+                return raw_key
+        # Both empty: block on the live queue only; batch jobs are picked up on the next call
+        return self.client.brpoplpush(self._queue(INTERACTIVE), self._k("processing"), block_seconds)
+
+    def _store_result(self, key: str, result: Dict[str, Any], kind: str):
+        ttl = self.result_ttls.get(kind, self.result_ttl) if _cacheable(result) else self.error_ttl
+        self.client.set(self._k("result", key), json.dumps(result), ex=ttl)
+        self.client.delete(self._k("job", key), self._k("blob", key))
+
+    def requeue_expired(self) -> int:
+        """
+        Put back jobs whose worker died (lease expired)
+
+        A job is only requeued when it is seen without a lease on two sweeps in
+        a row, so a worker that has just claimed it has time to take the lease.
+        """
+        requeued = 0
+        suspects = set()
+        for raw_key in self.client.lrange(self._k("processing"), 0, -1):
+            key = raw_key.decode() if isinstance(raw_key, bytes) else raw_key
+            if self.client.exists(self._k("lease", key)):
+                continue
+            if key in self._suspects and self.client.lrem(self._k("processing"), 1, key):
+                raw_record = self.client.get(self._k("job", key))
+                priority = json.loads(raw_record).get("priority") if raw_record else None
+                self.client.lpush(self._queue(priority), key)
+                requeued += 1
+                print(f"[WARNING] Requeued job with expired lease: {key}")
+            else:
+                suspects.add(key)
+        self._suspects = suspects
+        return requeued
+
+    def run_worker(self, handlers: Dict[str, Callable], stop_event: Optional[threading.Event] = None):
+        """Consume jobs until stop_event is set, sweeping expired leases periodically"""
+        stop_event = stop_event or threading.Event()
+        sweep_interval = max(self.lease_seconds / 2, 1)
+        next_sweep = time.monotonic() + sweep_interval
+        print(f"[INFO] Job worker {self.worker_id} started")
+        while not stop_event.is_set():
+            try:
+                self.work_once(handlers)
+                if time.monotonic() >= next_sweep:
+                    self.requeue_expired()
+                    next_sweep = time.monotonic() + sweep_interval
+            except Exception as e:
+                print(f"[ERROR] Job worker error: {str(e)}")
+                time.sleep(1)
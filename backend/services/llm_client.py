@@ -0,0 +1,239 @@
+"""
+LLM Client for Gemini calls
+Wraps genai.GenerativeModel with single-flight deduplication, per-call
+deadlines, hedged retries and a circuit breaker
+"""
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Optional
+
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "20"))
+LLM_HEDGE_MIN_SECONDS = float(os.getenv("LLM_HEDGE_MIN_SECONDS", "1.0"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+# LLM stand-in for load tests: never call Gemini, callers take their local path
+LLM_STANDIN = os.getenv("LLM_STANDIN", "0") == "1"
+
+
+class LLMUnavailableError(Exception):
+    """Raised when the LLM call failed, timed out or the circuit is open"""
+
+
+_fallback_tracker: contextvars.ContextVar = contextvars.ContextVar("llm_fallback_tracker", default=None)
+
+
+@contextlib.contextmanager
+def track_fallbacks():
+    """
+    Record whether any LLM call in the block was unavailable
+
+    Yields a dict whose "fallback" is True afterwards if a caller had to use
+    its local fallback, e.g. so such degraded results are not cached.
+    """
+    state = {"fallback": False}
+    token = _fallback_tracker.set(state)
+    try:
+        yield state
+    finally:
+        _fallback_tracker.reset(token)
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    closed -> open after `failure_threshold` failures in a row; open -> half-open
+    after `cooldown` seconds, where one trial call decides whether to close again.
+    """
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES,
+                 cooldown: float = LLM_BREAKER_COOLDOWN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"[WARNING] LLM circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+
+class LLMClient:
+    """Resilient front for a genai.GenerativeModel"""
+
+    def __init__(self, model, timeout: float = LLM_TIMEOUT_SECONDS,
+                 hedge_min_delay: float = LLM_HEDGE_MIN_SECONDS,
+                 breaker: Optional[CircuitBreaker] = None, max_workers: int = 8,
+                 enabled: bool = not LLM_STANDIN):
+        """
+        Args:
+            model: genai.GenerativeModel (anything with generate_content)
+            timeout: Deadline in seconds for a whole call, hedges included
+            hedge_min_delay: Lower bound for the hedge delay until enough
+                latency samples exist to use the observed p95
+            breaker: Circuit breaker shared by all calls through this client
+            max_workers: Threads available for primary and hedged requests
+            enabled: When False every call raises LLMUnavailableError
+                without touching the model (LLM_STANDIN=1)
+        """
+        self.model = model
+        self.enabled = enabled
+        self.timeout = timeout
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = breaker or CircuitBreaker()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self._latencies = deque(maxlen=200)
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    # ----------------------------------------
+    # PUBLIC API
+    # ----------------------------------------
+    def generate(self, prompt: str, generation_config: Optional[Dict[str, Any]] = None,
+                 timeout: Optional[float] = None) -> str:
+        """
+        Generate text for a prompt
+
+        Identical concurrent calls share one upstream request. Raises
+        LLMUnavailableError on timeout, upstream error or open circuit so
+        callers can drop to their local fallback.
+        """
+        try:
+            return self._generate(prompt, generation_config, timeout)
+        except LLMUnavailableError:
+            state = _fallback_tracker.get()
+            if state is not None:
+                state["fallback"] = True
+            raise
+
+    def _generate(self, prompt: str, generation_config: Optional[Dict[str, Any]], timeout: Optional[float]) -> str:
+        if not self.enabled:
+            raise LLMUnavailableError("LLM stand-in enabled")
+        key = json.dumps([prompt, generation_config], sort_keys=True, default=str)
+        with self._lock:
+            shared = self._in_flight.get(key)
+            if shared is None:
+                shared = Future()
+                self._in_flight[key] = shared
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            return self._wait_shared(shared, timeout)
+
+        try:
+            text = self._call(prompt, generation_config, timeout or self.timeout)
+            shared.set_result(text)
+            return text
+        except BaseException as e:
+            shared.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def hedge_delay(self) -> float:
+        """Current hedge delay: observed p95 latency, never below the configured floor"""
+        samples = sorted(self._latencies)
+        if len(samples) < 20:
+            return max(self.hedge_min_delay, self.timeout / 4)
+        p95 = samples[int(len(samples) * 0.95) - 1]
+        return max(self.hedge_min_delay, p95)
+
+    # ----------------------------------------
+    # INTERNALS
+    # ----------------------------------------
+    def _wait_shared(self, shared: Future, timeout: Optional[float]) -> str:
+        try:
+            return shared.result(timeout=timeout or self.timeout)
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            raise LLMUnavailableError(str(e)) from e
+
+    def _request(self, prompt: str, generation_config: Optional[Dict[str, Any]], timeout: float) -> str:
+        started = time.monotonic()
+        kwargs = {"request_options": {"timeout": timeout}}
+        if generation_config:
+            kwargs["generation_config"] = generation_config
+        response = self.model.generate_content(prompt, **kwargs)
+        text = response.text.strip()
+        self._latencies.append(time.monotonic() - started)
+        return text
+
+    def _call(self, prompt: str, generation_config: Optional[Dict[str, Any]], timeout: float) -> str:
+        if not self.breaker.allow():
+            raise LLMUnavailableError("LLM circuit is open")
+
+        deadline = time.monotonic() + timeout
+        pending = {self._executor.submit(self._request, prompt, generation_config, timeout)}
+        hedged = False
+        last_error: Optional[BaseException] = None
+
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            wait_for = remaining if hedged else min(remaining, self.hedge_delay())
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    self.breaker.record_success()
+                    return future.result()
+                last_error = future.exception()
+
+            # Primary is slow (or failed fast) - send one duplicate request
+            if not hedged and time.monotonic() < deadline:
+                hedged = True
+                print("[INFO] Hedging slow Gemini request")
+                pending.add(self._executor.submit(
+                    self._request, prompt, generation_config, max(deadline - time.monotonic(), 0.1)
+                ))
+
+        for future in pending:
+            future.cancel()
+        self.breaker.record_failure()
+        if last_error is not None:
+            raise LLMUnavailableError(f"{type(last_error).__name__}: {last_error}") from last_error
+        raise LLMUnavailableError(f"LLM call exceeded {timeout:.1f}s deadline")
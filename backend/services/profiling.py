@@ -0,0 +1,265 @@
+"""
+On-demand Profiling
+Opt-in (ENABLE_PROFILING=1, with PROFILING_ADMIN_TOKEN) profiling of single requests and of the whole
+process. Disabled, nothing is installed and `profiled_section` returns the
+function unchanged, so there is no overhead at all.
+
+Per request: send `X-Profile: cprofile|pyinstrument|torch` (or `?profile=...`);
+the Whisper and Gemini stages of that request are profiled and the response
+carries `X-Profile-Url` to download the result.
+
+Whole process: GET /admin/profile?seconds=N samples every thread and returns
+folded stacks for flamegraph.pl / speedscope.
+"""
+import contextvars
+import cProfile
+import functools
+import importlib.util
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Callable, Optional
+
+PROFILING_ENABLED = os.getenv("ENABLE_PROFILING", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "audio-analysis-profiles"))
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN")
+# Oldest saved profiles are deleted beyond this many
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "100"))
+MAX_SAMPLE_SECONDS = 120
+
+PROFILE_KINDS = ("cprofile", "pyinstrument", "torch")
+
+_current_profile: contextvars.ContextVar = contextvars.ContextVar("current_profile", default=None)
+_active = threading.local()
+
+
+class RequestProfile:
+    """Profiles collected from the profiled sections of one request"""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.profile_id = uuid.uuid4().hex[:12]
+        self.sections = []
+        self._stats: Optional[pstats.Stats] = None
+        self._sessions = []
+        self._traces = []
+        self._lock = threading.Lock()
+
+    def run(self, name: str, fn: Callable, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            if self.kind == "pyinstrument":
+                return self._run_pyinstrument(fn, *args, **kwargs)
+            if self.kind == "torch":
+                return self._run_torch(fn, *args, **kwargs)
+            return self._run_cprofile(fn, *args, **kwargs)
+        finally:
+            with self._lock:
+                self.sections.append({"name": name, "seconds": round(time.perf_counter() - started, 4)})
+
+    def _run_cprofile(self, fn, *args, **kwargs):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profiler)
+                else:
+                    self._stats.add(profiler)
+
+    def _run_pyinstrument(self, fn, *args, **kwargs):
+        from pyinstrument import Profiler
+
+        profiler = Profiler(async_mode="disabled")
+        profiler.start()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            session = profiler.stop()
+            with self._lock:
+                self._sessions.append(session)
+
+    def _run_torch(self, fn, *args, **kwargs):
+        from torch.profiler import ProfilerActivity, profile
+
+        with profile(activities=[ProfilerActivity.CPU], record_shapes=False) as prof:
+            result = fn(*args, **kwargs)
+        with self._lock:
+            self._traces.append(prof)
+        return result
+
+    def save(self, directory: str = PROFILE_DIR) -> Optional[str]:
+        """Write the profile and return its file name (None if nothing was captured)"""
+        os.makedirs(directory, exist_ok=True)
+        if self.kind == "cprofile" and self._stats is not None:
+            name = f"{self.profile_id}.prof"
+            self._stats.dump_stats(os.path.join(directory, name))
+            return name
+        if self.kind == "pyinstrument" and self._sessions:
+            from pyinstrument.renderers import SpeedscopeRenderer
+            from pyinstrument.session import Session
+
+            session = functools.reduce(Session.combine, self._sessions)
+            name = f"{self.profile_id}.speedscope.json"
+            with open(os.path.join(directory, name), "w") as f:
+                f.write(SpeedscopeRenderer().render(session))
+            return name
+        if self.kind == "torch" and self._traces:
+            # One chrome trace per profiled section; the first is the Whisper stage in practice
+            name = f"{self.profile_id}.trace.json"
+            self._traces[0].export_chrome_trace(os.path.join(directory, name))
+            return name
+        return None
+
+
+def prune_profiles(directory: str = PROFILE_DIR, keep: int = PROFILE_MAX_FILES):
+    """Delete the oldest saved profiles so at most `keep` remain"""
+    try:
+        paths = [os.path.join(directory, name) for name in os.listdir(directory)]
+    except FileNotFoundError:
+        return
+    paths.sort(key=lambda path: os.path.getmtime(path), reverse=True)
+    for path in paths[keep:]:
+        try:
+            os.unlink(path)
+        except OSError as e:
+            print(f"[WARNING] Could not delete old profile {path}: {str(e)}")
+
+
+def _save_profile(profile: RequestProfile) -> Optional[str]:
+    name = profile.save()
+    if name:
+        prune_profiles()
+    return name
+
+
+def _profiled(name: str, fn: Callable) -> Callable:
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = _current_profile.get()
+        # Nested sections run inside the outer section's profiler
+        if profile is None or getattr(_active, "depth", 0):
+            return fn(*args, **kwargs)
+        _active.depth = 1
+        try:
+            return profile.run(name, fn, *args, **kwargs)
+        finally:
+            _active.depth = 0
+    return wrapper
+
+
+def profiled_section(name: str):
+    """Mark a function as a profiled stage of the request path"""
+    def decorator(fn: Callable) -> Callable:
+        return _profiled(name, fn) if PROFILING_ENABLED else fn
+    return decorator
+
+
+# ----------------------------------------
+# WHOLE-PROCESS SAMPLING
+# ----------------------------------------
+def sample_process(seconds: float, interval: float = 0.005) -> str:
+    """
+    Sample the stacks of every other thread for `seconds`
+
+    Returns:
+        Folded stacks ("frame;frame;frame count" per line), the input format
+        of flamegraph.pl and speedscope
+    """
+    counts: Counter = Counter()
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f"thread-{thread_id}"))
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return "\n".join(f"{stack} {count}" for stack, count in counts.most_common()) + "\n"
+
+
+# ----------------------------------------
+# FASTAPI WIRING
+# ----------------------------------------
+def install_profiling(app):
+    """
+    Add the profiling middleware and admin routes (no-op unless ENABLE_PROFILING=1)
+
+    Both can read any request's data and tie up a thread for minutes, so
+    they are never installed without PROFILING_ADMIN_TOKEN.
+    """
+    if not PROFILING_ENABLED:
+        return
+    if not PROFILING_ADMIN_TOKEN:
+        raise RuntimeError("ENABLE_PROFILING=1 requires PROFILING_ADMIN_TOKEN to be set")
+
+    from fastapi import HTTPException, Query, Request
+    from fastapi.concurrency import run_in_threadpool
+    from fastapi.responses import FileResponse, PlainTextResponse
+
+    def check_token(request: Request):
+        if request.headers.get("x-admin-token") != PROFILING_ADMIN_TOKEN:
+            raise HTTPException(status_code=403, detail="Invalid admin token")
+
+    @app.middleware("http")
+    async def profile_request(request: Request, call_next):
+        kind = (request.headers.get("x-profile") or request.query_params.get("profile") or "").lower()
+        if not kind:
+            return await call_next(request)
+        if kind in ("1", "true"):
+            kind = "cprofile"
+        if kind == "pyinstrument" and importlib.util.find_spec("pyinstrument") is None:
+            print("[WARNING] pyinstrument is not installed, profiling with cProfile instead")
+            kind = "cprofile"
+        if kind not in PROFILE_KINDS or request.headers.get("x-admin-token") != PROFILING_ADMIN_TOKEN:
+            return await call_next(request)
+
+        profile = RequestProfile(kind)
+        token = _current_profile.set(profile)
+        try:
+            response = await call_next(request)
+        finally:
+            _current_profile.reset(token)
+
+        name = await run_in_threadpool(_save_profile, profile)
+        response.headers["X-Profile-Id"] = profile.profile_id
+        response.headers["X-Profile-Sections"] = ",".join(f"{s['name']}={s['seconds']}s" for s in profile.sections)
+        if name:
+            response.headers["X-Profile-Url"] = f"/admin/profiles/{name}"
+        return response
+
+    @app.get("/admin/profiles/{name}")
+    async def download_profile(name: str, request: Request):
+        """Download a saved per-request profile"""
+        check_token(request)
+        path = os.path.join(PROFILE_DIR, os.path.basename(name))
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="Profile not found")
+        return FileResponse(path, filename=os.path.basename(name))
+
+    @app.get("/admin/profile")
+    async def profile_process(request: Request, seconds: float = Query(10, gt=0, le=MAX_SAMPLE_SECONDS),
+                              interval: float = Query(0.005, ge=0.001, le=1)):
+        """Sample the whole process for N seconds and return folded stacks"""
+        check_token(request)
+        folded = await run_in_threadpool(sample_process, seconds, interval)
+        return PlainTextResponse(
+            folded, headers={"Content-Disposition": f'attachment; filename="process-{int(time.time())}.folded"'}
+        )
+
+    print(f"[INFO] Profiling enabled, profiles saved to {PROFILE_DIR}")
@@ -0,0 +1,327 @@
+"""
+Request Scheduler
+Priority classes (interactive vs batch), per-client rate limits and fair
+queuing in front of the transcription and LLM stages
+
+Live calls always get the next free slot of a stage; batch work is served
+round-robin per client with what is left, and yields its Whisper slot
+between audio windows whenever a live call is waiting.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITY_CLASSES = (INTERACTIVE, BATCH)
+
+ASR_SLOTS = int(os.getenv("SCHEDULER_ASR_SLOTS", "1"))
+LLM_SLOTS = int(os.getenv("SCHEDULER_LLM_SLOTS", "8"))
+# Per-client token buckets: sustained requests/second and burst size
+INTERACTIVE_RATE = float(os.getenv("SCHEDULER_INTERACTIVE_RATE", "5"))
+INTERACTIVE_BURST = int(os.getenv("SCHEDULER_INTERACTIVE_BURST", "10"))
+BATCH_RATE = float(os.getenv("SCHEDULER_BATCH_RATE", "20"))
+BATCH_BURST = int(os.getenv("SCHEDULER_BATCH_BURST", "100"))
+# Batch work waiting longer than this is served like interactive work
+BATCH_MAX_WAIT_SECONDS = float(os.getenv("SCHEDULER_BATCH_MAX_WAIT_SECONDS", "300"))
+MAX_TRACKED_CLIENTS = 10000
+
+_current_ticket = threading.local()
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a client is over its rate limit for a priority class"""
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class Ticket:
+    """
+    One request's claim on a stage slot
+
+    Requests wait for the grant as an asyncio future on the event loop, so a
+    queued request holds no thread. A batch ticket parked at a yield point
+    waits on `event` in its worker thread instead.
+    """
+
+    def __init__(self, stage: "Stage", priority: str, client_id: str,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.stage = stage
+        self.priority = priority
+        self.client_id = client_id
+        self.enqueued_at = time.monotonic()
+        self.wait_seconds = 0.0
+        self.loop = loop
+        self.future: Optional[asyncio.Future] = loop.create_future() if loop else None
+        self.event = threading.Event()
+
+    def grant(self):
+        """Hand the slot to this ticket (called with the stage lock held)"""
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(self._resolve)
+        else:
+            self.event.set()
+
+    def _resolve(self):
+        if self.future.done():
+            # The request was cancelled while the grant was on its way: pass the slot on
+            self.stage.release()
+        else:
+            self.future.set_result(None)
+
+
+class WaitStats:
+    """Rolling queue-wait statistics for one stage and priority class"""
+
+    def __init__(self, window: int = 1000):
+        self.waits: Deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.preemptions = 0
+
+    def record(self, seconds: float):
+        self.waits.append(seconds)
+        self.count += 1
+
+    def snapshot(self, queued: int) -> Dict[str, Any]:
+        waits = sorted(self.waits)
+        return {
+            "requests": self.count,
+            "queued": queued,
+            "preemptions": self.preemptions,
+            "wait_ms_mean": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "wait_ms_p95": round(waits[max(int(len(waits) * 0.95) - 1, 0)] * 1000, 1) if waits else 0.0,
+            "wait_ms_max": round(waits[-1] * 1000, 1) if waits else 0.0,
+        }
+
+
+class Stage:
+    """
+    A pool of `slots` for one pipeline stage (e.g. the single Whisper model)
+
+    Waiters are kept per class and per client; within a class clients are
+    served round-robin so one client's backlog cannot starve the others.
+    Granted work runs on the stage's own executor, never on the shared
+    threadpool: running tickets and tickets parked at a yield point (at
+    most `slots` of each) each hold one of its threads.
+    """
+
+    def __init__(self, name: str, slots: int):
+        self.name = name
+        self.slots = slots
+        self.busy = 0
+        self.parked = 0
+        self.executor = ThreadPoolExecutor(max_workers=slots * 2, thread_name_prefix=f"stage-{name}")
+        self._lock = threading.Lock()
+        # class -> client_id -> FIFO of tickets (OrderedDict gives round-robin order)
+        self._queues: Dict[str, "OrderedDict[str, Deque[Ticket]]"] = {c: OrderedDict() for c in PRIORITY_CLASSES}
+        self.stats: Dict[str, WaitStats] = {c: WaitStats() for c in PRIORITY_CLASSES}
+
+    def queued(self, priority: str) -> int:
+        return sum(len(q) for q in self._queues[priority].values())
+
+    def enqueue(self, ticket: Ticket, front: bool = False):
+        with self._lock:
+            self._add(ticket, front)
+            self._dispatch()
+
+    def discard(self, ticket: Ticket) -> bool:
+        """Remove a ticket that is still waiting; False if it was already granted"""
+        with self._lock:
+            clients = self._queues[ticket.priority]
+            queue = clients.get(ticket.client_id)
+            if queue is None or ticket not in queue:
+                return False
+            queue.remove(ticket)
+            if not queue:
+                del clients[ticket.client_id]
+            return True
+
+    def release(self):
+        with self._lock:
+            self.busy -= 1
+            self._dispatch()
+
+    def park(self, ticket: Ticket) -> bool:
+        """
+        Give up a running batch ticket's slot to waiting interactive work
+
+        The ticket queues again at the front of its client's queue and is
+        granted through `ticket.event`. Returns False (keep running) when no
+        live call is waiting or too many threads are parked already.
+        """
+        with self._lock:
+            if not self._queues[INTERACTIVE] or self.parked >= self.slots:
+                return False
+            self.parked += 1
+            self.stats[BATCH].preemptions += 1
+            ticket.future = None
+            ticket.event.clear()
+            ticket.enqueued_at = time.monotonic()
+            self.busy -= 1
+            self._add(ticket, front=True)
+            self._dispatch()
+            return True
+
+    def unpark(self):
+        with self._lock:
+            self.parked -= 1
+
+    def _add(self, ticket: Ticket, front: bool):
+        queue = self._queues[ticket.priority].setdefault(ticket.client_id, deque())
+        if front:
+            queue.appendleft(ticket)
+        else:
+            queue.append(ticket)
+
+    def _next_ticket(self) -> Optional[Ticket]:
+        batch = self._queues[BATCH]
+        # Starvation guard: a batch job that waited too long goes first
+        for client_id, queue in batch.items():
+            if time.monotonic() - queue[0].enqueued_at > BATCH_MAX_WAIT_SECONDS:
+                return self._pop(BATCH, client_id)
+        for priority in PRIORITY_CLASSES:
+            if self._queues[priority]:
+                return self._pop(priority, next(iter(self._queues[priority])))
+        return None
+
+    def _pop(self, priority: str, client_id: str) -> Ticket:
+        clients = self._queues[priority]
+        queue = clients.pop(client_id)
+        ticket = queue.popleft()
+        if queue:
+            clients[client_id] = queue  # re-insert at the back: round-robin
+        return ticket
+
+    def _dispatch(self):
+        while self.busy < self.slots:
+            ticket = self._next_ticket()
+            if ticket is None:
+                return
+            self.busy += 1
+            ticket.wait_seconds += time.monotonic() - ticket.enqueued_at
+            ticket.grant()
+
+
+class Scheduler:
+    """Admission control plus per-stage fair queues"""
+
+    def __init__(self, stage_slots: Optional[Dict[str, int]] = None):
+        stage_slots = stage_slots or {"asr": ASR_SLOTS, "llm": LLM_SLOTS}
+        self.stages = {name: Stage(name, slots) for name, slots in stage_slots.items()}
+        self._limits = {INTERACTIVE: (INTERACTIVE_RATE, INTERACTIVE_BURST), BATCH: (BATCH_RATE, BATCH_BURST)}
+        self._buckets: "OrderedDict[tuple, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize_priority(value: Optional[str]) -> str:
+        value = (value or INTERACTIVE).strip().lower()
+        return value if value in PRIORITY_CLASSES else INTERACTIVE
+
+    def admit(self, priority: str, client_id: str):
+        """Charge one request to the client's bucket; raises RateLimitExceeded when empty"""
+        key = (priority, client_id)
+        with self._lock:
+            bucket = self._buckets.pop(key, None) or TokenBucket(*self._limits[priority])
+            self._buckets[key] = bucket
+            while len(self._buckets) > MAX_TRACKED_CLIENTS:
+                self._buckets.popitem(last=False)
+            if not bucket.take():
+                raise RateLimitExceeded(f"Rate limit exceeded for {priority} client {client_id}")
+
+    async def run(self, stage_name: str, priority: str, client_id: str, fn: Callable, *args,
+                  timings: Optional[Dict[str, float]] = None, **kwargs):
+        """
+        Wait for a slot of the stage on the event loop, then run fn(*args, **kwargs)
+        on the stage's executor
+
+        Queue wait (including time parked at yield points) is added to
+        timings["<stage>_queue_ms"] when timings is given.
+        """
+        stage = self.stages[stage_name]
+        loop = asyncio.get_running_loop()
+        ticket = Ticket(stage, priority, client_id, loop)
+        stage.enqueue(ticket)
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                stage.release()
+            else:
+                # Still queued: drop it. Already granted: Ticket._resolve passes the slot on
+                stage.discard(ticket)
+            raise
+
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            stage.executor, context.run, self._run_granted, ticket, stage_name, fn, args, kwargs, timings
+        )
+
+    @staticmethod
+    def _run_granted(ticket: Ticket, stage_name: str, fn: Callable, args: tuple, kwargs: Dict[str, Any],
+                     timings: Optional[Dict[str, float]]):
+        _current_ticket.ticket = ticket
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_ticket.ticket = None
+            ticket.stage.release()
+            ticket.stage.stats[ticket.priority].record(ticket.wait_seconds)
+            if timings is not None:
+                key = f"{stage_name}_queue_ms"
+                timings[key] = round(timings.get(key, 0) + ticket.wait_seconds * 1000, 1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "slots": stage.slots,
+                "busy": stage.busy,
+                "parked": stage.parked,
+                **{priority: stage.stats[priority].snapshot(stage.queued(priority)) for priority in PRIORITY_CLASSES},
+            }
+            for name, stage in self.stages.items()
+        }
+
+
+def preemptible() -> bool:
+    """True when the current thread runs batch work that should offer yield points"""
+    ticket: Optional[Ticket] = getattr(_current_ticket, "ticket", None)
+    return ticket is not None and ticket.priority == BATCH
+
+
+def yield_point():
+    """
+    Let waiting interactive work take this thread's stage slot
+
+    Called between units of work (e.g. audio windows) from inside a stage.
+    No-op outside the scheduler and for interactive tickets; a batch ticket
+    gives up its slot, queues again at the front of its client's queue and
+    blocks here until it is granted a slot again.
+    """
+    ticket: Optional[Ticket] = getattr(_current_ticket, "ticket", None)
+    if ticket is None or ticket.priority != BATCH:
+        return
+    stage = ticket.stage
+    if not stage.park(ticket):
+        return
+    ticket.event.wait()
+    stage.unpark()
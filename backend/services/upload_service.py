@@ -0,0 +1,320 @@
+"""
+Upload Service for Audio/Video Files
+Enforces size/duration limits and sniffs the container format from the
+first few KB before any heavy work
+
+The size limit and the format sniff run in `UploadLimitMiddleware` while
+the request body is being received, so an oversized or non-audio upload is
+refused before it is parsed into a temp file.
+"""
+import contextlib
+import os
+import shutil
+import struct
+import tempfile
+import time
+from typing import Callable, Dict, Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+# ----------------------------------------
+# LIMITS (override with environment variables)
+# ----------------------------------------
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+MAX_AUDIO_DURATION_SECONDS = float(os.getenv("MAX_AUDIO_DURATION_SECONDS", "600"))
+CHUNK_SIZE = 64 * 1024
+SNIFF_BYTES = 8 * 1024
+# Give up looking for the file part's header in the multipart body after this much
+MULTIPART_SNIFF_LIMIT = 64 * 1024
+
+# Paths that accept uploads and are guarded by the Content-Length check
+UPLOAD_PATHS = ("/process-audio", "/analyze", "/analyze-audio")
+
+# MPEG-1 Layer III bitrates (kbps) indexed by the 4-bit header field
+_MP3_BITRATES = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0]
+
+
+class UploadRejected(HTTPException):
+    """Raised when an upload is refused before transcription"""
+
+
+class SpooledUpload:
+    """
+    A received upload, backed by the spooled file Starlette parsed it into
+
+    Starlette keeps small uploads in memory and rolls larger ones over to an
+    anonymous temp file; the body is not copied again. ffmpeg needs a real
+    path, so `path()` writes a named copy only when it is asked for.
+    """
+
+    def __init__(self, source, suffix: str = ".wav", size: int = 0):
+        self.suffix = suffix
+        self.size = size
+        self.format: Optional[str] = None
+        self.duration: Optional[float] = None
+        self._source = source
+        self._path: Optional[str] = None
+
+    @contextlib.contextmanager
+    def open(self):
+        """Readable binary stream over the full upload, positioned at the start"""
+        self._source.seek(0)
+        yield self._source
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE):
+        """Yield the body in chunks without loading it all"""
+        self._source.seek(0)
+        while True:
+            chunk = self._source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def path(self) -> str:
+        """Return a path on disk holding the full upload"""
+        if self._path is None:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=self.suffix) as temp:
+                self._path = temp.name
+                self._source.seek(0)
+                shutil.copyfileobj(self._source, temp, CHUNK_SIZE)
+        return self._path
+
+    def close(self):
+        """Delete the named copy, if one was made (FastAPI closes the upload itself)"""
+        if self._path and os.path.exists(self._path):
+            try:
+                os.unlink(self._path)
+            except Exception as e:
+                print(f"Error deleting temp file: {str(e)}")
+        self._path = None
+
+
+# ----------------------------------------
+# HEADER SNIFFING
+# ----------------------------------------
+def sniff_format(header: bytes) -> Optional[str]:
+    """Identify the container from magic bytes, or None if not audio/video"""
+    if len(header) >= 12 and header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+        return "wav"
+    if header[:4] == b"OggS":
+        return "ogg"
+    if header[:4] == b"fLaC":
+        return "flac"
+    if header[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm"
+    if len(header) >= 12 and header[4:8] == b"ftyp":
+        return "mp4"
+    if header[:6] == b"#!AMR\n":
+        return "amr"
+    if len(header) >= 12 and header[:4] == b"FORM" and header[8:12] in (b"AIFF", b"AIFC"):
+        return "aiff"
+    if header[:3] == b"ID3":
+        return "mp3"
+    if len(header) >= 2 and header[0] == 0xFF:
+        if header[1] & 0xF6 == 0xF0:
+            return "aac"
+        if header[1] & 0xE0 == 0xE0:
+            return "mp3"
+    return None
+
+
+def _wav_duration(header: bytes, total_size: Optional[int]) -> Optional[float]:
+    """Read duration from the fmt/data chunks of a RIFF/WAVE header"""
+    pos = 12
+    byte_rate = None
+    while pos + 8 <= len(header):
+        chunk_id = header[pos:pos + 4]
+        chunk_size = struct.unpack("<I", header[pos + 4:pos + 8])[0]
+        body = pos + 8
+        if chunk_id == b"fmt " and body + 12 <= len(header):
+            byte_rate = struct.unpack("<I", header[body + 8:body + 12])[0]
+        elif chunk_id == b"data":
+            if not byte_rate:
+                return None
+            # Streamed WAVs often carry 0 or 0xFFFFFFFF here; fall back to file size
+            if chunk_size in (0, 0xFFFFFFFF) and total_size:
+                chunk_size = total_size - body
+            return chunk_size / byte_rate
+        pos = body + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _mp3_duration(header: bytes, total_size: Optional[int]) -> Optional[float]:
+    """Estimate duration of a (CBR) MP3 from its first frame bitrate and size"""
+    if not total_size:
+        return None
+    pos = 0
+    if header[:3] == b"ID3" and len(header) >= 10:
+        size = header[6:10]
+        pos = 10 + ((size[0] << 21) | (size[1] << 14) | (size[2] << 7) | size[3])
+    while pos + 4 <= len(header):
+        if header[pos] == 0xFF and header[pos + 1] & 0xE0 == 0xE0:
+            bitrate = _MP3_BITRATES[header[pos + 2] >> 4]
+            if bitrate:
+                return (total_size - pos) * 8 / (bitrate * 1000)
+        pos += 1
+    return None
+
+
+def probe_duration(fmt: str, header: bytes, total_size: Optional[int]) -> Optional[float]:
+    """Best-effort duration from the header; None when it cannot be known cheaply"""
+    try:
+        if fmt == "wav":
+            return _wav_duration(header, total_size)
+        if fmt == "mp3":
+            return _mp3_duration(header, total_size)
+    except (struct.error, IndexError):
+        return None
+    return None
+
+
+# ----------------------------------------
+# UPLOAD HANDLING
+# ----------------------------------------
+def _check_duration(duration: Optional[float]):
+    if duration is not None and duration > MAX_AUDIO_DURATION_SECONDS:
+        raise UploadRejected(
+            status_code=413,
+            detail=f"Audio is {duration:.0f}s long; the limit is {MAX_AUDIO_DURATION_SECONDS:.0f}s",
+        )
+
+
+async def receive_upload(file: UploadFile) -> SpooledUpload:
+    """
+    Validate a parsed UploadFile and wrap it as a SpooledUpload
+
+    Args:
+        file: Incoming FastAPI upload (body already limited by UploadLimitMiddleware)
+
+    Returns:
+        SpooledUpload with `format` and (when known) `duration` set
+
+    Raises:
+        UploadRejected: 413 when too large/long, 415 when not audio/video
+    """
+    await file.seek(0)
+    header = await file.read(SNIFF_BYTES)
+    total_size = file.size
+    if total_size is None:
+        file.file.seek(0, os.SEEK_END)
+        total_size = file.file.tell()
+    if total_size > MAX_UPLOAD_BYTES:
+        raise UploadRejected(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+
+    file_extension = os.path.splitext(file.filename or "")[1] or ".wav"
+    upload = SpooledUpload(file.file, suffix=file_extension, size=total_size)
+    upload.format = sniff_format(header)
+    if upload.format is None:
+        raise UploadRejected(status_code=415, detail="Unsupported or non-audio file format")
+    upload.duration = probe_duration(upload.format, header, total_size)
+    _check_duration(upload.duration)
+    return upload
+
+
+def content_length_exceeded(headers: Dict[str, str]) -> bool:
+    """True when a declared Content-Length is already over the upload limit"""
+    length = headers.get("content-length")
+    if not length or not length.isdigit():
+        return False
+    return int(length) > MAX_UPLOAD_BYTES
+
+
+def _sniff_multipart(head: bytes, complete: bool) -> Optional[bool]:
+    """
+    Sniff the first file part of a multipart body from its first bytes
+
+    Returns:
+        True/False once the part is known to be audio or not, None while
+        more of the body is needed. Bodies where no file part shows up
+        early are let through; receive_upload checks them again.
+    """
+    start = head.find(b"filename=")
+    if start != -1:
+        body = head.find(b"\r\n\r\n", start)
+        if body != -1:
+            data = head[body + 4:body + 20]
+            if len(data) >= 16 or complete:
+                return sniff_format(data) is not None
+    if complete or len(head) > MULTIPART_SNIFF_LIMIT:
+        return True
+    return None
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware that enforces the upload limits while the body arrives
+
+    Requests declaring a Content-Length over MAX_UPLOAD_BYTES are refused
+    before any body is read; chunked uploads are cut off as soon as they pass
+    the limit, and a file part that is not audio/video is refused with 415
+    from its first bytes.
+
+    `on_reject(scope, status_code, detail, upload_bytes, started)` is called
+    for every upload refused here, since those never reach the endpoint.
+    """
+
+    def __init__(self, app, paths=UPLOAD_PATHS, max_bytes: int = MAX_UPLOAD_BYTES,
+                 on_reject: Optional[Callable[[dict, int, str, int, float], None]] = None):
+        self.app = app
+        self.paths = paths
+        self.max_bytes = max_bytes
+        self.on_reject = on_reject
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        if content_length_exceeded(headers):
+            await self._reject(scope, receive, send, 413, f"Upload exceeds {self.max_bytes} bytes",
+                               int(headers["content-length"]), started)
+            return
+
+        received = 0
+        head = b""
+        sniffed = False
+        rejection = None
+
+        async def limited_receive():
+            nonlocal received, head, sniffed, rejection
+            message = await receive()
+            if message["type"] != "http.request":
+                return message
+            chunk = message.get("body", b"")
+            received += len(chunk)
+            if received > self.max_bytes:
+                rejection = (413, f"Upload exceeds {self.max_bytes} bytes")
+            elif not sniffed:
+                head += chunk
+                verdict = _sniff_multipart(head, complete=not message.get("more_body", False))
+                if verdict is not None:
+                    sniffed, head = True, b""
+                    if not verdict:
+                        rejection = (415, "Unsupported or non-audio file format")
+            if rejection:
+                raise UploadRejected(status_code=rejection[0], detail=rejection[1])
+            return message
+
+        async def guarded_send(message):
+            # The app's own response to the aborted body parse is replaced below
+            if rejection is None:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if rejection is None:
+                raise
+        if rejection is not None:
+            await self._reject(scope, receive, send, *rejection, received, started)
+
+    async def _reject(self, scope, receive, send, status_code: int, detail: str, upload_bytes: int, started: float):
+        if self.on_reject is not None:
+            try:
+                self.on_reject(scope, status_code, detail, upload_bytes, started)
+            except Exception as e:
+                print(f"[WARNING] Upload rejection hook failed: {str(e)}")
+        await JSONResponse(status_code=status_code, content={"detail": detail})(scope, receive, send)
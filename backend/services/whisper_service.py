@@ -3,41 +3,193 @@ Whisper Service for Audio/Video Transcription
 Handles speech-to-text conversion using OpenAI Whisper
 """
 import whisper
+import torch
+import numpy as np
 import tempfile
 import os
-from typing import Dict, Optional
+import time
+import wave
+from typing import BinaryIO, Callable, Dict, Optional, Sequence, Union
+from .whisper_weights import load_mmap_model
+from .profiling import profiled_section
+from .scheduler import preemptible, yield_point
+
+# Share one page-cache copy of the weights across worker processes (CPU only)
+WHISPER_MMAP = os.getenv("WHISPER_MMAP", "1") == "1"
+
+# ASR stand-in for load tests: skips the model to measure service overhead alone
+ASR_STANDIN = os.getenv("ASR_STANDIN", "0") == "1"
+ASR_STANDIN_TEXT = os.getenv(
+    "ASR_STANDIN_TEXT", "Hello, my name is Rahul Sharma. My order ID is MZ12345 and my mobile number is 9876543210."
+)
+ASR_STANDIN_DELAY_SECONDS = float(os.getenv("ASR_STANDIN_DELAY_SECONDS", "0"))
+
+# Early-exit transcription: decode in windows and stop once the entities are in.
+# Whisper pads every call to 30s of audio, so shorter windows only add calls.
+EARLY_EXIT_WINDOW_SECONDS = float(os.getenv("EARLY_EXIT_WINDOW_SECONDS", "30"))
+EARLY_EXIT_MIN_LOGPROB = float(os.getenv("EARLY_EXIT_MIN_LOGPROB", "-1.0"))
+
+EntityExtractor = Callable[[str], Dict[str, str]]
+
+def load_native_pcm(source: Union[str, BinaryIO]) -> Optional[np.ndarray]:
+    """
+    Read a 16 kHz mono 16-bit PCM WAV straight into Whisper's input format
+
+    This is what the frontend uploads; decoding it here skips the ffmpeg
+    subprocess whisper.load_audio would spawn. Returns None for anything
+    else, which then goes through ffmpeg as before.
+    """
+    try:
+        with wave.open(source, "rb") as wav:
+            if (wav.getnchannels(), wav.getsampwidth(), wav.getframerate(), wav.getcomptype()) != \
+                    (1, 2, whisper.audio.SAMPLE_RATE, "NONE"):
+                return None
+            pcm = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
 
 class WhisperService:
     """Service for transcribing audio/video files using Whisper"""
     
-    def __init__(self, model_name: str = "base"):
+    def __init__(self, model_name: str = "base", use_mmap: Optional[bool] = None):
         """
         Initialize Whisper model
         
         Args:
             model_name: Whisper model size ('tiny', 'base', 'small', 'medium', 'large')
+            use_mmap: Load read-only memory-mapped weights shared between
+                processes (defaults to WHISPER_MMAP; ignored on GPU)
         """
+        if use_mmap is None:
+            use_mmap = WHISPER_MMAP
         print(f"Loading Whisper model: {model_name}...")
-        self.model = whisper.load_model(model_name)
+        if use_mmap and not torch.cuda.is_available():
+            self.model = load_mmap_model(model_name)
+        else:
+            self.model = whisper.load_model(model_name)
         print(f"Whisper model loaded successfully")
     
-    def transcribe_file(self, file_path: str) -> Dict[str, any]:
+    @profiled_section("whisper")
+    def transcribe_file(self, file_path: str, entity_extractor: Optional[EntityExtractor] = None,
+                        required_entities: Sequence[str] = ()) -> Dict[str, any]:
         """
         Transcribe audio/video file
         
         Args:
             file_path: Path to audio/video file
+            entity_extractor: With required_entities, enables early exit (see transcribe_audio)
+            required_entities: Entity names the extractor must return to stop early
             
         Returns:
             dict with transcription result containing 'text' key
         """
         try:
             print(f"Transcribing file: {file_path}")
-            result = self.model.transcribe(file_path)
+            audio = load_native_pcm(file_path)
+            if (entity_extractor and required_entities) or preemptible():
+                if audio is None:
+                    audio = whisper.load_audio(file_path)
+                return self._transcribe_until(audio, entity_extractor, required_entities)
+            result = self.model.transcribe(audio if audio is not None else file_path)
             return result
         except Exception as e:
             print(f"Error in transcription: {str(e)}")
             raise
+
+    @profiled_section("whisper")
+    def transcribe_audio(self, audio: np.ndarray, entity_extractor: Optional[EntityExtractor] = None,
+                         required_entities: Sequence[str] = ()) -> Dict[str, any]:
+        """
+        Transcribe already decoded 16 kHz mono float32 samples (no ffmpeg)
+        
+        Args:
+            audio: Samples as returned by load_native_pcm
+            entity_extractor: Function text -> entities dict. Together with
+                required_entities this decodes window by window and stops as
+                soon as all required entities are found with confidence;
+                omit it to get the full transcript (e.g. for audits)
+            required_entities: Entity names that must all be non-empty
+            
+        Returns:
+            dict with transcription result containing 'text' key, plus
+            'early_exit' and 'decoded_seconds' in early-exit mode
+        """
+        try:
+            print(f"Transcribing {len(audio) / whisper.audio.SAMPLE_RATE:.1f}s of PCM audio")
+            if (entity_extractor and required_entities) or preemptible():
+                return self._transcribe_until(audio, entity_extractor, required_entities)
+            return self.model.transcribe(audio)
+        except Exception as e:
+            print(f"Error in transcription: {str(e)}")
+            raise
+
+    def _transcribe_until(self, audio: np.ndarray, entity_extractor: Optional[EntityExtractor],
+                          required_entities: Sequence[str],
+                          window_seconds: float = EARLY_EXIT_WINDOW_SECONDS) -> Dict[str, any]:
+        """
+        Decode `audio` window by window, stopping once the entities are found
+
+        Each window is cut at the end of its last complete segment, so a word
+        (or an order ID) running over the window edge is decoded again with
+        the next window instead of being split. The cut never moves the next
+        window forward by less than half a window, so long segments cannot
+        make the windows crawl. Entities only count when the
+        window's segments decoded with an average log-probability of at least
+        EARLY_EXIT_MIN_LOGPROB.
+
+        Batch requests are decoded this way too (without an extractor) so the
+        scheduler can hand the model to a live call between windows.
+        """
+        sample_rate = whisper.audio.SAMPLE_RATE
+        window = int(window_seconds * sample_rate)
+        min_advance = window // 2
+        total = len(audio)
+        start = 0
+        text = ""
+        segments = []
+        language = None
+
+        while start < total:
+            chunk = audio[start:start + window]
+            result = self.model.transcribe(
+                chunk, language=language, initial_prompt=text[-200:] or None, condition_on_previous_text=False
+            )
+            language = language or result.get("language")
+            chunk_segments = result.get("segments", [])
+            chunk_seconds = len(chunk) / sample_rate
+            advance = len(chunk)
+
+            # Last segment touches the window edge and more audio follows: redo it next window
+            if start + len(chunk) < total and len(chunk_segments) > 1 and \
+                    chunk_segments[-1]["end"] >= chunk_seconds - 0.5:
+                cut = int(chunk_segments[-1]["start"] * sample_rate)
+                if cut >= min_advance:
+                    advance = cut
+                    chunk_segments = chunk_segments[:-1]
+
+            offset = start / sample_rate
+            for segment in chunk_segments:
+                segment = dict(segment, start=segment["start"] + offset, end=segment["end"] + offset)
+                segments.append(segment)
+                text += segment["text"]
+            start += advance
+
+            confident = bool(chunk_segments) and np.mean(
+                [segment.get("avg_logprob", 0.0) for segment in chunk_segments]
+            ) >= EARLY_EXIT_MIN_LOGPROB
+            entities = entity_extractor(text) if confident and entity_extractor else {}
+            if required_entities and start < total and all(entities.get(name) for name in required_entities):
+                print(f"[INFO] Early exit after {start / sample_rate:.1f}s of {total / sample_rate:.1f}s: "
+                      f"{', '.join(required_entities)} found")
+                return {"text": text, "segments": segments, "language": language,
+                        "early_exit": True, "decoded_seconds": start / sample_rate}
+            if start < total:
+                yield_point()
+
+        return {"text": text, "segments": segments, "language": language,
+                "early_exit": False, "decoded_seconds": total / sample_rate}
     
     def transcribe_audio_content(self, audio_content: bytes, file_extension: str = ".wav") -> str:
         """
@@ -69,3 +221,31 @@ class WhisperService:
                 except Exception as e:
                     print(f"Error deleting temp file: {str(e)}")
 
+
+class StandinWhisperService:
+    """Drop-in for WhisperService that returns a fixed transcript without loading a model"""
+
+    def __init__(self, text: str = ASR_STANDIN_TEXT, delay: float = ASR_STANDIN_DELAY_SECONDS):
+        print("Using ASR stand-in (no Whisper model loaded)")
+        self.text = text
+        self.delay = delay
+
+    def transcribe_file(self, file_path: str, entity_extractor: Optional[EntityExtractor] = None,
+                        required_entities: Sequence[str] = ()) -> Dict[str, any]:
+        if self.delay:
+            time.sleep(self.delay)
+        return {"text": self.text, "segments": [], "language": "en"}
+
+    def transcribe_audio(self, audio: np.ndarray, entity_extractor: Optional[EntityExtractor] = None,
+                         required_entities: Sequence[str] = ()) -> Dict[str, any]:
+        return self.transcribe_file("")
+
+    def transcribe_audio_content(self, audio_content: bytes, file_extension: str = ".wav") -> str:
+        return self.transcribe_file("")["text"]
+
+
+def create_whisper_service(model_name: str = "base"):
+    """WhisperService, or the stand-in when ASR_STANDIN=1"""
+    if ASR_STANDIN:
+        return StandinWhisperService()
+    return WhisperService(model_name=model_name)
@@ -0,0 +1,93 @@
+"""
+Memory-mapped Whisper weights
+Converts a Whisper checkpoint once into an fp32 file that torch can mmap,
+so every worker process shares one physical copy through the page cache
+"""
+import os
+from typing import Optional
+
+import torch
+import whisper
+from whisper.model import AudioEncoder, ModelDimensions, TextDecoder, Whisper
+
+MMAP_SUFFIX = ".mmap.pt"
+
+
+def default_cache_dir() -> str:
+    """Same cache directory whisper.load_model downloads into"""
+    default = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.getenv("WHISPER_MMAP_DIR", os.path.join(os.getenv("XDG_CACHE_HOME", default), "whisper"))
+
+
+def convert_checkpoint(model_name: str, cache_dir: Optional[str] = None) -> str:
+    """
+    Write the mmap-friendly copy of a Whisper model if it does not exist yet
+
+    Weights are stored as contiguous fp32 tensors (CPU inference casts to fp32
+    anyway), together with the dims and the non-persistent buffers (causal
+    mask, alignment heads) that are not part of the state dict.
+    The file is written under a temporary name and renamed into place, so
+    workers racing on first start never see a partial file.
+
+    Returns:
+        Path to the converted file
+    """
+    cache_dir = cache_dir or default_cache_dir()
+    target = os.path.join(cache_dir, os.path.basename(model_name) + MMAP_SUFFIX)
+    if os.path.exists(target):
+        return target
+
+    print(f"Converting Whisper model '{model_name}' to mmap format...")
+    os.makedirs(cache_dir, exist_ok=True)
+    model = whisper.load_model(model_name, device="cpu", download_root=cache_dir)
+    state_dict = model.state_dict()
+    checkpoint = {
+        "dims": dict(model.dims.__dict__),
+        "model_state_dict": {k: v.float().contiguous() for k, v in state_dict.items()},
+        "buffers": {
+            name: (buffer.to_dense() if buffer.is_sparse else buffer)
+            for name, buffer in model.named_buffers() if name not in state_dict
+        },
+    }
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    torch.save(checkpoint, tmp_path)
+    os.replace(tmp_path, target)
+    print(f"Saved mmap weights to {target}")
+    return target
+
+
+def load_mmap_model(model_name: str, cache_dir: Optional[str] = None) -> Whisper:
+    """
+    Load a Whisper model whose parameters alias a read-only mmap of the weights
+
+    The module is built on the meta device (no allocation, no random init) and
+    the mmapped tensors are assigned into it, so loading does not copy or
+    deserialize the weights and the pages stay shared between processes.
+    """
+    path = convert_checkpoint(model_name, cache_dir)
+    checkpoint = torch.load(path, map_location="cpu", mmap=True)
+
+    dims = ModelDimensions(**checkpoint["dims"])
+    # Mirrors Whisper.__init__, but builds the layers on the meta device;
+    # Whisper() itself cannot run there (to_sparse has no meta kernel)
+    model = Whisper.__new__(Whisper)
+    torch.nn.Module.__init__(model)
+    model.dims = dims
+    with torch.device("meta"):
+        model.encoder = AudioEncoder(
+            dims.n_mels, dims.n_audio_ctx, dims.n_audio_state, dims.n_audio_head, dims.n_audio_layer
+        )
+        model.decoder = TextDecoder(
+            dims.n_vocab, dims.n_text_ctx, dims.n_text_state, dims.n_text_head, dims.n_text_layer
+        )
+    model.load_state_dict(checkpoint["model_state_dict"], assign=True)
+
+    for name, buffer in checkpoint["buffers"].items():
+        module_name, _, buffer_name = name.rpartition(".")
+        module = model.get_submodule(module_name) if module_name else model
+        if name == "alignment_heads":
+            buffer = buffer.to_sparse()
+        module.register_buffer(buffer_name, buffer, persistent=False)
+
+    model.requires_grad_(False)
+    return model.eval()
@@ -0,0 +1,70 @@
+"""
+Stateless job worker for distributed mode
+Consumes transcription and LLM jobs from the shared broker (JOB_BROKER_URL)
+
+Run one or more per node:
+    JOB_BROKER_URL=redis://broker:6379/0 python worker.py
+"""
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+from services.job_queue import JobQueue, connect
+from services.llm_client import track_fallbacks
+from services.whisper_service import WhisperService, create_whisper_service
+from services.gemini_server import extract_and_respond, extract_details, format_service_boy_response, extract_details_locally
+
+
+def build_handlers(whisper_service: WhisperService):
+    """Job handlers keyed by job kind"""
+
+    def transcribe(payload: Dict[str, Any], blob: Optional[Iterator[bytes]]) -> Dict[str, Any]:
+        temp_path = None
+        try:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=payload.get("suffix", ".wav")) as temp:
+                temp_path = temp.name
+                for chunk in blob or ():
+                    temp.write(chunk)
+            required = payload.get("required") or []
+            extractor = extract_details_locally if required else None
+            result = whisper_service.transcribe_file(temp_path, extractor, required)
+            return {"text": result.get("text", ""), "early_exit": result.get("early_exit", False)}
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    def llm(payload: Dict[str, Any], blob: Optional[Iterator[bytes]]) -> Dict[str, Any]:
+        transcript = payload["transcript"]
+        known = payload.get("known")
+        with track_fallbacks() as status:
+            if payload.get("combined", True):
+                data, response_text = extract_and_respond(transcript, known)
+            else:
+                data = extract_details(transcript, known)
+                response_text = format_service_boy_response(data, transcript)
+        # Regex/template answers from a Gemini outage must not be served from the cache
+        return {"data": data, "response_text": response_text, "cacheable": not status["fallback"]}
+
+    return {"transcribe": transcribe, "llm": llm}
+
+
+def start_worker_thread(job_queue: JobQueue, whisper_service: WhisperService) -> threading.Event:
+    """Run a worker in a daemon thread (used by main.py for memory:// brokers)"""
+    stop_event = threading.Event()
+    thread = threading.Thread(
+        target=job_queue.run_worker,
+        args=(build_handlers(whisper_service), stop_event),
+        name="job-worker",
+        daemon=True,
+    )
+    thread.start()
+    return stop_event
+
+
+if __name__ == "__main__":
+    broker_url = os.getenv("JOB_BROKER_URL")
+    if not broker_url or broker_url.startswith("memory://"):
+        raise SystemExit("Set JOB_BROKER_URL to a shared redis:// broker to run a standalone worker")
+    service = create_whisper_service(model_name=os.getenv("WHISPER_MODEL", "base"))
+    JobQueue(connect(broker_url)).run_worker(build_handlers(service))
@@ -1,6 +1,7 @@
 import { Component, OnInit, OnDestroy } from '@angular/core';
 import { CommonModule } from '@angular/common';
 import { AudioAnalysisService, AudioAnalysisResult } from '../../services/audio-analysis.service';
+import { AudioEncoderService } from '../../services/audio-encoder.service';
 
 @Component({
   selector: 'app-audio-upload',
@@ -27,7 +28,10 @@ export class AudioUploadComponent implements OnInit, OnDestroy {
   audioPlayer: HTMLAudioElement | null = null;
   isPlayingAudio: boolean = false;
 
-  constructor(private audioService: AudioAnalysisService) {}
+  constructor(
+    private audioService: AudioAnalysisService,
+    private audioEncoder: AudioEncoderService
+  ) {}
 
   ngOnInit() {
     // Check for browser support
@@ -100,7 +104,7 @@ export class AudioUploadComponent implements OnInit, OnDestroy {
     return `${mins.toString().padStart(2, '0')}:${secs.toString().padStart(2, '0')}`;
   }
 
-  upload() {
+  async upload() {
     if (!this.selectedFile) return;
 
     this.isLoading = true;
@@ -108,7 +112,10 @@ export class AudioUploadComponent implements OnInit, OnDestroy {
     this.result = null;
     this.stopAudio(); // Stop any playing audio
 
-    this.audioService.analyzeAudio(this.selectedFile).subscribe({
+    // Send 16 kHz mono PCM instead of the raw recording/video
+    const compactFile = await this.audioEncoder.toCompactWav(this.selectedFile);
+
+    this.audioService.analyzeAudio(compactFile).subscribe({
       next: (res) => {
         this.result = res;
         this.isLoading = false;
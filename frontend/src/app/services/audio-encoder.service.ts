@@ -0,0 +1,81 @@
+import { Injectable } from '@angular/core';
+
+// Whisper works on 16 kHz mono audio; anything more is thrown away server-side
+export const TARGET_SAMPLE_RATE = 16000;
+
+@Injectable({
+  providedIn: 'root'
+})
+export class AudioEncoderService {
+
+  /**
+   * Decode an audio/video file, downmix to mono, resample to 16 kHz and
+   * encode as 16-bit PCM WAV, which the backend reads without ffmpeg.
+   * Falls back to the original file if the browser cannot decode it.
+   */
+  async toCompactWav(file: File): Promise<File> {
+    try {
+      const decoded = await this.decode(file);
+      const samples = await this.resampleToMono(decoded);
+      const wav = this.encodeWav(samples, TARGET_SAMPLE_RATE);
+      const name = file.name.replace(/\.[^.]+$/, '') + '.wav';
+      return new File([wav], name, { type: 'audio/wav' });
+    } catch (error) {
+      console.warn('Could not downsample audio in the browser, uploading original file:', error);
+      return file;
+    }
+  }
+
+  private async decode(file: File): Promise<AudioBuffer> {
+    const context = new AudioContext();
+    try {
+      return await context.decodeAudioData(await file.arrayBuffer());
+    } finally {
+      context.close();
+    }
+  }
+
+  private async resampleToMono(buffer: AudioBuffer): Promise<Float32Array> {
+    const length = Math.ceil(buffer.duration * TARGET_SAMPLE_RATE);
+    // A 1-channel offline context downmixes and resamples while rendering
+    const offline = new OfflineAudioContext(1, length, TARGET_SAMPLE_RATE);
+    const source = offline.createBufferSource();
+    source.buffer = buffer;
+    source.connect(offline.destination);
+    source.start();
+    const rendered = await offline.startRendering();
+    return rendered.getChannelData(0);
+  }
+
+  private encodeWav(samples: Float32Array, sampleRate: number): ArrayBuffer {
+    const dataSize = samples.length * 2;
+    const buffer = new ArrayBuffer(44 + dataSize);
+    const view = new DataView(buffer);
+    const writeString = (offset: number, value: string) => {
+      for (let i = 0; i < value.length; i++) {
+        view.setUint8(offset + i, value.charCodeAt(i));
+      }
+    };
+
+    writeString(0, 'RIFF');
+    view.setUint32(4, 36 + dataSize, true);
+    writeString(8, 'WAVE');
+    writeString(12, 'fmt ');
+    view.setUint32(16, 16, true);             // fmt chunk size
+    view.setUint16(20, 1, true);              // PCM
+    view.setUint16(22, 1, true);              // mono
+    view.setUint32(24, sampleRate, true);
+    view.setUint32(28, sampleRate * 2, true); // byte rate
+    view.setUint16(32, 2, true);              // block align
+    view.setUint16(34, 16, true);             // bits per sample
+    writeString(36, 'data');
+    view.setUint32(40, dataSize, true);
+
+    let offset = 44;
+    for (let i = 0; i < samples.length; i++, offset += 2) {
+      const s = Math.max(-1, Math.min(1, samples[i]));
+      view.setInt16(offset, s < 0 ? s * 0x8000 : s * 0x7fff, true);
+    }
+    return buffer;
+  }
+}
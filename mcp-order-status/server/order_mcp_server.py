@@ -7,6 +7,7 @@ import json
 import sys
 from typing import Dict, Any, Optional
 from excel_loader import find_order, create_sample_excel
+from session_store import SessionStore
 import os
 
 class OrderMCPServer:
@@ -17,6 +18,7 @@ class OrderMCPServer:
         # Ensure Excel file exists
         if not os.path.exists("order_data.xlsx"):
             create_sample_excel()
+        self.sessions = SessionStore()
     
     def extract_mobile_number(self, text: str) -> Optional[str]:
         """Extract 10-digit mobile number from text"""
@@ -91,12 +93,14 @@ class OrderMCPServer:
         
         return None
     
-    def process(self, text: str) -> Dict[str, Any]:
+    def process(self, text: str, session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Process transcription text: Extract mobile number and order ID, then lookup in Excel
         
         Args:
             text: Input text (transcribed audio)
+            session_id: Optional call session; mobile number / order ID from
+                earlier utterances are reused and lookups are not repeated
             
         Returns:
             Dictionary with extracted data and order status (backend format)
@@ -111,12 +115,26 @@ class OrderMCPServer:
         print(f"[INFO] Extracted Mobile: {mobile_number}")
         print(f"[INFO] Extracted Order ID: {order_id}")
         
+        # Merge with what earlier utterances of this call already gave us
+        session = None
+        if session_id is not None:
+            session = self.sessions.get_or_create(session_id)
+            mobile_number = mobile_number or session.entities.get("mobile_number")
+            order_id = order_id or session.entities.get("order_id")
+            session.add_turn(text, {"mobile_number": mobile_number, "order_id": order_id})
+        
         # Lookup order in Excel
         order_data = None
         status_found = False
         
         if mobile_number and order_id:
-            order_data = find_order(mobile_number, order_id)
+            lookup_key = f"{mobile_number}:{order_id}"
+            if session is not None and lookup_key in session.lookups:
+                order_data = session.lookups[lookup_key]
+            else:
+                order_data = find_order(mobile_number, order_id)
+                if session is not None:
+                    session.lookups[lookup_key] = order_data
             if order_data:
                 status_found = True
                 print(f"[OK] Order found: {order_data.get('order_status', 'Unknown')}")
@@ -162,19 +180,21 @@ class OrderMCPServer:
             "response_text": response_text,
             "response_voice_text": response_text
         }
+        if session is not None:
+            result["session_id"] = session.session_id
         
         return result
     
-    def orderStatusChecker(self, text: str) -> Dict[str, Any]:
+    def orderStatusChecker(self, text: str, session_id: Optional[str] = None) -> Dict[str, Any]:
         """Legacy method - calls process() for backward compatibility"""
-        return self.process(text)
+        return self.process(text, session_id)
 
 # MCP Server instance
 mcp_server = OrderMCPServer()
 
-def handle_mcp_request(text: str) -> Dict[str, Any]:
+def handle_mcp_request(text: str, session_id: Optional[str] = None) -> Dict[str, Any]:
     """Handle MCP request - entry point for external calls"""
-    return mcp_server.process(text)
+    return mcp_server.process(text, session_id)
 
 if __name__ == "__main__":
     # Handle command line input
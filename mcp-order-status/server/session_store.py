@@ -0,0 +1,79 @@
+"""
+Session Store for multi-turn calls
+Keeps entities and order lookups from earlier utterances of a call, so a
+follow-up utterance only has to contribute what is still missing
+
+Copy of backend/services/session_store.py (this server is deployed on its
+own); keep the two identical.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "900"))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_MAX_TURNS = 20
+
+# Entities carried over between turns
+SESSION_ENTITIES = ("order_id", "mobile_number", "name")
+
+
+class Session:
+    """State accumulated over the turns of one call"""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.entities: Dict[str, str] = {}
+        # lookup key -> order row (None when not found)
+        self.lookups: Dict[str, Optional[Dict[str, str]]] = {}
+        self.transcripts: List[str] = []
+        self.updated_at = time.monotonic()
+
+    def add_turn(self, transcript: str, data: Dict[str, Any]):
+        """Record an utterance and keep any entities it resolved"""
+        self.transcripts = (self.transcripts + [transcript])[-SESSION_MAX_TURNS:]
+        for key in SESSION_ENTITIES:
+            if data.get(key):
+                self.entities[key] = data[key]
+
+
+class SessionStore:
+    """In-process session store with TTL eviction and an LRU size cap"""
+
+    def __init__(self, ttl_seconds: int = SESSION_TTL_SECONDS, max_sessions: int = SESSION_MAX_SESSIONS):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, session_id: Optional[str] = None) -> Session:
+        """Return the live session for session_id, or start a new one"""
+        with self._lock:
+            self._evict(time.monotonic())
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = Session(session_id or uuid.uuid4().hex)
+                self._sessions[session.session_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            session.updated_at = time.monotonic()
+            self._sessions.move_to_end(session.session_id)
+            return session
+
+    def end(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict(self, now: float):
+        # Least recently used first, so stop at the first live session
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.updated_at < self.ttl_seconds:
+                break
+            self._sessions.popitem(last=False)